@@ -0,0 +1,295 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from pathlib import Path
+
+import generate_spectrum_index
+import index_metrics
+import synthetic_spectra
+
+# Spectra per file of the tiny jobs whose startup is measured
+STARTUP_SPECTRA = 10
+
+# Spectra of the small and the large indexed files whose peak memory is compared, with a single peak each so the large
+# files stay small on disk. Peak memory may grow by MEMORY_GROWTH_BUDGET bytes at most between the two
+MEMORY_CHECK_SPECTRA = (1000, 100000)
+MEMORY_CHECK_TYPES = ['indexedmzML', 'mzXML']
+MEMORY_GROWTH_BUDGET = 16e6
+
+# Index files of the synthetic spectra of the default parameters, with and without --param_groups. Synthetic types
+# with the same index output share one golden file, named synthetic_<spectra>_<ms2_per_ms1>.<output>.scans
+GOLDEN_FOLDER = Path(__file__).resolve().parent.joinpath('golden')
+GOLDEN_SPECTRA = 400
+GOLDEN_OUTPUTS = {'mzML': 'mzML', 'indexedmzML': 'mzML', 'mzML.gz': 'mzML', 'mzXML': 'mzXML', 'mgf': 'mgf', 'mgf.gz': 'mgf'}
+
+def arguments():
+    parser = argparse.ArgumentParser(description='Benchmark spectrum index engines against each other and against golden index files')
+    parser.add_argument('input_spectra', type = Path, nargs='*', help='Spectrum files of types mzML, mzML.gz, mzXML, or mgf.')
+    parser.add_argument('-g','--engines', type = str, nargs='+', choices = generate_spectrum_index.ENGINES, help='Engines to compare on mzML and mzXML files, mgf files are read by the mgf scanner and, with pyteomics, by the pyteomics.mgf reader it replaced', default=generate_spectrum_index.ENGINES)
+    parser.add_argument('-r','--repeat', type = int, help='Number of timed runs per engine, best is reported', default=1)
+    parser.add_argument('-l','--default_ms_level', type = str, help='Default MSlevel', default='0')
+    parser.add_argument('-b','--block_workers', type = int, help='Number of processes scanning one blocked (BGZF) mzML.gz file in parallel', default=1)
+    parser.add_argument('-y','--synthetic_folder', type = Path, help='Generate synthetic spectrum files into this folder and benchmark them as well')
+    parser.add_argument('-t','--synthetic_types', type = str, nargs='+', choices = synthetic_spectra.SYNTHETIC_TYPES, help='Synthetic file types to generate', default=synthetic_spectra.SYNTHETIC_TYPES)
+    parser.add_argument('-n','--spectra', type = int, help='Number of spectra per synthetic file, golden files exist for the default, timings need more', default=GOLDEN_SPECTRA)
+    parser.add_argument('-k','--ms2_per_ms1', type = int, help='Number of MS2 spectra following each MS1 spectrum in synthetic files', default=4)
+    parser.add_argument('-a','--peaks', type = int, help='Number of peaks per synthetic spectrum', default=50)
+    parser.add_argument('-p','--param_groups', dest='param_groups', action='store_true', help='Flag to give the MS level of synthetic mzML spectra through referenceableParamGroups')
+    parser.add_argument('-G','--golden_folder', type = Path, help='Folder of golden index files named <input file name>.scans, or by GOLDEN_OUTPUTS for synthetic files, outputs must match them byte for byte', default=GOLDEN_FOLDER)
+    parser.add_argument('-u','--update_golden', dest='update_golden', action='store_true', help='Flag to write the index files of this run into the golden folder instead of checking them')
+    parser.add_argument('-S','--startup', dest='startup', action='store_true', help='Flag to also time generate_spectrum_index.py from process start to exit without arguments, on an unknown filetype and on tiny mgf and mzML files')
+    parser.add_argument('-s','--startup_budget', type = float, help='Seconds each startup may take at most, a slower one fails the benchmark (implies --startup)')
+    parser.add_argument('-R','--startup_repeat', type = int, help='Number of timed runs per startup scenario, best is reported', default=5)
+    parser.add_argument('-M','--memory_check', dest='memory_check', action='store_true', help='Flag to also check that the peak memory of the stream and indexed engines does not grow with the spectrum count of indexed mzML and mzXML files')
+    parser.add_argument('-j','--output_json', type = Path, help='Write the results as JSON to this file, to compare runs across versions')
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+def run_index(input_spectrum, input_filetype, default_ms_level, engine, block_workers, output):
+    # Runs in a fresh process, so the peak RSS belongs to this run alone
+    spectrum_count = 0
+    def count_spectra(spectra):
+        nonlocal spectrum_count
+        for spectrum in spectra:
+            spectrum_count += 1
+            yield spectrum
+    start = time.perf_counter()
+    if engine == 'pyteomics' and input_filetype in generate_spectrum_index.MGF_FILETYPES:
+        spectra = index_mgf_reference(input_spectrum, input_filetype)
+    else:
+        spectra = generate_spectrum_index.index_spectra(input_spectrum, input_filetype, default_ms_level, engine, block_workers)
+    generate_spectrum_index.write_index(count_spectra(spectra), output)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss of this process carries over the peak of the benchmark that started it, VmHWM does not. ru_maxrss is in kB
+    # on Linux, block workers are child processes
+    peak_rss = max(index_metrics.get_peak_memory(), resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+    return elapsed, spectrum_count, peak_rss
+
+def index_mgf_reference(input_spectrum, input_filetype):
+    # MS2+ index as generate_spectrum_index.py numbered the spectra of pyteomics.mgf
+    import pyteomics_readers
+    ms2plus_scan_idx = 0
+    for native_id, ms_level in pyteomics_readers.read_mgf_pyteomics(input_spectrum, input_filetype):
+        yield generate_spectrum_index.Spectrum(native_id, ms_level, -1 if ms_level == 1 else ms2plus_scan_idx)
+        if ms_level > 1:
+            ms2plus_scan_idx += 1
+
+def time_engine(input_spectrum, input_filetype, default_ms_level, engine, block_workers, repeat, output):
+    best_time = None
+    peak_rss = 0
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            elapsed, spectrum_count, run_peak_rss = executor.submit(run_index, input_spectrum, input_filetype, default_ms_level, engine, block_workers, output).result()
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+        peak_rss = max(peak_rss, run_peak_rss)
+    return best_time, spectrum_count, peak_rss
+
+def time_startup(arguments, repeat):
+    # Whole command from process start to exit, as a workflow step running it on one small file sees it
+    command = [sys.executable, str(Path(generate_spectrum_index.__file__).resolve())] + [str(argument) for argument in arguments]
+    best_time = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if best_time is None or elapsed < best_time:
+            best_time = elapsed
+    return best_time
+
+def measure_startup(repeat, budget):
+    results = []
+    with tempfile.TemporaryDirectory() as startup_folder:
+        input_folder = Path(startup_folder).joinpath('spectra')
+        output_folder = Path(startup_folder).joinpath('output')
+        mgf, mzml = synthetic_spectra.write_synthetic_spectra(input_folder, ['mgf', 'mzML'], STARTUP_SPECTRA)
+        unknown = input_folder.joinpath('unknown.txt')
+        unknown.write_text('Not a spectrum file\n')
+        scenarios = [
+            ('usage', []),
+            ('unknown_filetype', ['-i', unknown, '-o', output_folder]),
+            ('mgf', ['-i', mgf, '-o', output_folder]),
+            ('mzml', ['-i', mzml, '-o', output_folder])
+        ]
+        for scenario, arguments in scenarios:
+            elapsed = time_startup(arguments, repeat)
+            results.append({
+                'scenario': scenario,
+                'seconds': elapsed,
+                'within_budget': None if budget is None else elapsed <= budget
+            })
+    return results
+
+def measure_memory(engines, repeat):
+    # Parsers that keep index or spectrum elements around grow with the file, the others stay flat
+    results = []
+    with tempfile.TemporaryDirectory() as memory_folder:
+        output = Path(memory_folder).joinpath('memory.scans')
+        small_spectra, large_spectra = MEMORY_CHECK_SPECTRA
+        small_files = synthetic_spectra.write_synthetic_spectra(Path(memory_folder).joinpath('small'), MEMORY_CHECK_TYPES, small_spectra, peaks=1)
+        large_files = synthetic_spectra.write_synthetic_spectra(Path(memory_folder).joinpath('large'), MEMORY_CHECK_TYPES, large_spectra, peaks=1)
+        for small_file, large_file in zip(small_files, large_files):
+            input_filetype = generate_spectrum_index.detect_input_filetype(large_file)
+            for engine in engines:
+                _, _, small_peak_rss = time_engine(small_file, input_filetype, '0', engine, 1, repeat, output)
+                _, _, large_peak_rss = time_engine(large_file, input_filetype, '0', engine, 1, repeat, output)
+                results.append({
+                    'file': large_file.name,
+                    'engine': engine,
+                    'small_peak_rss_mb': small_peak_rss / 1e6,
+                    'large_peak_rss_mb': large_peak_rss / 1e6,
+                    'within_budget': large_peak_rss - small_peak_rss <= MEMORY_GROWTH_BUDGET
+                })
+    return results
+
+def get_version(package):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+def main():
+    args = arguments()
+
+    input_spectra = list(args.input_spectra)
+    golden_names = {input_spectrum: input_spectrum.name + '.scans' for input_spectrum in input_spectra}
+    if args.synthetic_folder:
+        synthetic_files = synthetic_spectra.write_synthetic_spectra(args.synthetic_folder, args.synthetic_types, args.spectra, args.ms2_per_ms1, args.param_groups, args.peaks)
+        for synthetic_type, synthetic_file in zip(args.synthetic_types, synthetic_files):
+            # Peaks and param groups do not change the index, only the spectra and their MS levels do
+            golden_names[synthetic_file] = 'synthetic_{}_{}.{}.scans'.format(args.spectra, args.ms2_per_ms1, GOLDEN_OUTPUTS[synthetic_type])
+        input_spectra.extend(synthetic_files)
+
+    failures = 0
+    results = []
+
+    print('\t'.join(['file', 'size_mb', 'engine', 'spectra', 'seconds', 'spectra_per_sec', 'mb_per_sec', 'peak_rss_mb', 'speedup', 'golden']))
+    with tempfile.TemporaryDirectory() as output_folder:
+        for file_index, input_spectrum in enumerate(input_spectra):
+            input_filetype = generate_spectrum_index.detect_input_filetype(input_spectrum)
+            if input_filetype in generate_spectrum_index.XML_FILETYPES:
+                engines = args.engines
+            elif input_filetype in generate_spectrum_index.MGF_FILETYPES:
+                # The mgf scanner does not depend on the engine, pyteomics runs the pyteomics.mgf reference instead
+                engines = ['stream'] + [engine for engine in args.engines if engine == 'pyteomics']
+            else:
+                print('Skipping {}: unsupported filetype ({}).'.format(input_spectrum, input_filetype), file=sys.stderr)
+                continue
+            size_mb = input_spectrum.stat().st_size / 1e6
+
+            runs = {}
+            for engine in engines:
+                output = Path(output_folder).joinpath('{}.{}.scans'.format(file_index, engine))
+                runs[engine] = time_engine(input_spectrum, input_filetype, args.default_ms_level, engine, args.block_workers, args.repeat, output) + (output.read_bytes(),)
+
+            # Speedup is relative to the pyteomics path when it was run, otherwise to the first engine
+            baseline = 'pyteomics' if 'pyteomics' in runs else engines[0]
+            baseline_time, _, _, baseline_output = runs[baseline]
+
+            golden = args.golden_folder.joinpath(golden_names[input_spectrum]) if args.golden_folder else None
+            if golden and args.update_golden:
+                golden.parent.mkdir(parents=True, exist_ok=True)
+                golden.write_bytes(baseline_output)
+            golden_output = golden.read_bytes() if golden and golden.is_file() else None
+
+            for engine in engines:
+                elapsed, spectrum_count, peak_rss, output = runs[engine]
+                matches_baseline = output == baseline_output
+                if not matches_baseline:
+                    failures += 1
+                    print('Output of {} differs from {} for {}.'.format(engine, baseline, input_spectrum), file=sys.stderr)
+                matches_golden = None if golden_output is None else output == golden_output
+                if matches_golden is False:
+                    failures += 1
+                    print('Output of {} differs from golden file {} for {}.'.format(engine, golden, input_spectrum), file=sys.stderr)
+                result = {
+                    'file': str(input_spectrum),
+                    'filetype': input_filetype,
+                    'size_mb': size_mb,
+                    'engine': engine,
+                    'block_workers': args.block_workers,
+                    'spectra': spectrum_count,
+                    'seconds': elapsed,
+                    'spectra_per_sec': spectrum_count / elapsed if elapsed else 0,
+                    'mb_per_sec': size_mb / elapsed if elapsed else 0,
+                    'peak_rss_mb': peak_rss / 1e6,
+                    'speedup': baseline_time / elapsed if elapsed else 0,
+                    'matches_baseline': matches_baseline,
+                    'matches_golden': matches_golden
+                }
+                results.append(result)
+                print('\t'.join([
+                    result['file'],
+                    '{:.1f}'.format(size_mb),
+                    engine,
+                    str(spectrum_count),
+                    '{:.3f}'.format(elapsed),
+                    '{:.0f}'.format(result['spectra_per_sec']),
+                    '{:.1f}'.format(result['mb_per_sec']),
+                    '{:.0f}'.format(result['peak_rss_mb']),
+                    '{:.2f}'.format(result['speedup']),
+                    {None: '-', True: 'match', False: 'differs'}[matches_golden]
+                ]))
+
+    startup_results = None
+    if args.startup or args.startup_budget is not None:
+        startup_results = measure_startup(args.startup_repeat, args.startup_budget)
+        print('\t'.join(['startup', 'seconds', 'budget']))
+        for result in startup_results:
+            if result['within_budget'] is False:
+                failures += 1
+                print('Startup of {} took {:.3f} seconds, over the budget of {:.3f}.'.format(result['scenario'], result['seconds'], args.startup_budget), file=sys.stderr)
+            print('\t'.join([
+                result['scenario'],
+                '{:.3f}'.format(result['seconds']),
+                {None: '-', True: 'within', False: 'over'}[result['within_budget']]
+            ]))
+
+    memory_results = None
+    if args.memory_check:
+        # pyteomics decodes whole spectra and is not expected to stay flat
+        memory_results = measure_memory([engine for engine in args.engines if engine != 'pyteomics'], args.repeat)
+        print('\t'.join(['memory', 'engine', 'small_peak_rss_mb', 'large_peak_rss_mb', 'budget']))
+        for result in memory_results:
+            if not result['within_budget']:
+                failures += 1
+                print('Peak memory of {} on {} grew from {:.0f} MB to {:.0f} MB, over the budget of {:.0f} MB.'.format(result['engine'], result['file'], result['small_peak_rss_mb'], result['large_peak_rss_mb'], MEMORY_GROWTH_BUDGET / 1e6), file=sys.stderr)
+            print('\t'.join([
+                result['file'],
+                result['engine'],
+                '{:.0f}'.format(result['small_peak_rss_mb']),
+                '{:.0f}'.format(result['large_peak_rss_mb']),
+                'within' if result['within_budget'] else 'over'
+            ]))
+
+    if args.output_json:
+        report = {
+            'parser_version': generate_spectrum_index.PARSER_VERSION,
+            'python': platform.python_version(),
+            'pyteomics': get_version('pyteomics'),
+            'lxml': get_version('lxml'),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'results': results,
+            'startup_budget': args.startup_budget,
+            'startup': startup_results,
+            'memory': memory_results
+        }
+        with open(args.output_json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if failures > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import csv
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+import file_utils
+
+BINARY_INDEX_SUFFIX = '.scanidx'
+
+# Little-endian layout, sections are aligned to their item size:
+#   header                               magic, spectrum count, native ID bytes, hash table size
+#   ms2plusindex      int64[count]
+#   native ID offsets int64[count + 1]   native ID of row i is data[offsets[i]:offsets[i + 1]]
+#   hash table        int32[table size]  row of each native ID by crc32, linear probing, -1 is empty
+#   mslevel           int16[count]
+#   native ID data    utf-8 bytes
+MAGIC = b'SPECIDX1'
+HEADER = struct.Struct('<8sQQQ')
+EMPTY_SLOT = -1
+
+def _get_table_size(count):
+    # Power of two at least twice the row count keeps probe chains short
+    return 1 << max(1, (2 * count - 1).bit_length())
+
+def read_scans_file(scans_file):
+    with open(scans_file, newline='') as f:
+        for native_id, ms_level, ms2plus_index in csv.reader(f, delimiter='\t'):
+            yield native_id, int(ms_level), int(ms2plus_index)
+
+def write_binary_index(spectra, output_index):
+    # numpy is imported here, indexing without --binary_index does not pay for it at startup
+    import numpy as np
+
+    native_ids = []
+    ms_levels = []
+    ms2plus_indexes = []
+    for native_id, ms_level, ms2plus_index in spectra:
+        native_ids.append(native_id.encode('utf-8'))
+        ms_levels.append(ms_level)
+        ms2plus_indexes.append(ms2plus_index)
+    count = len(native_ids)
+
+    offsets = np.zeros(count + 1, dtype='<i8')
+    np.cumsum([len(native_id) for native_id in native_ids], out=offsets[1:])
+
+    table_size = _get_table_size(count)
+    mask = table_size - 1
+    table = [EMPTY_SLOT] * table_size
+    for row, native_id in enumerate(native_ids):
+        slot = zlib.crc32(native_id) & mask
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        table[slot] = row
+
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, count, int(offsets[-1]), table_size))
+            f.write(np.asarray(ms2plus_indexes, dtype='<i8').tobytes())
+            f.write(offsets.tobytes())
+            f.write(np.asarray(table, dtype='<i4').tobytes())
+            f.write(np.asarray(ms_levels, dtype='<i2').tobytes())
+            f.write(b''.join(native_ids))
+    file_utils.atomic_write(Path(output_index), write)
+
+def convert_scans_file(scans_file, output_index=None):
+    if output_index is None:
+        output_index = Path(scans_file).with_suffix(BINARY_INDEX_SUFFIX)
+    write_binary_index(read_scans_file(scans_file), output_index)
+    return output_index
+
+class BinaryIndex:
+    # Rows are (nativeid, mslevel, ms2plusindex) like the .scans file, the columns are numpy views of the memory map
+
+    def __init__(self, index_file):
+        import numpy as np
+        self._data = np.memmap(index_file, dtype=np.uint8, mode='r')
+        magic, count, native_id_size, table_size = HEADER.unpack(self._data[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError('{} is not a binary spectrum index'.format(index_file))
+        position = HEADER.size
+        self.ms2plusindex = self._data[position:position + 8 * count].view('<i8')
+        position += 8 * count
+        self._offsets = self._data[position:position + 8 * (count + 1)].view('<i8')
+        position += 8 * (count + 1)
+        self._table = self._data[position:position + 4 * table_size].view('<i4')
+        position += 4 * table_size
+        self.mslevel = self._data[position:position + 2 * count].view('<i2')
+        position += 2 * count
+        self._native_ids = self._data[position:position + native_id_size]
+        self._mask = table_size - 1
+
+    def __len__(self):
+        return len(self.ms2plusindex)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        return self.nativeid(row), int(self.mslevel[row]), int(self.ms2plusindex[row])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def _native_id_bytes(self, row):
+        return self._native_ids[self._offsets[row]:self._offsets[row + 1]].tobytes()
+
+    def nativeid(self, row):
+        return self._native_id_bytes(row).decode('utf-8')
+
+    def find(self, native_id):
+        # Row of the first spectrum with this nativeID, None if there is none
+        native_id = native_id.encode('utf-8')
+        slot = zlib.crc32(native_id) & self._mask
+        while True:
+            row = int(self._table[slot])
+            if row == EMPTY_SLOT:
+                return None
+            if self._native_id_bytes(row) == native_id:
+                return row
+            slot = (slot + 1) & self._mask
+
+    def get(self, native_id):
+        row = self.find(native_id)
+        return None if row is None else self[row]
+
+def arguments():
+    parser = argparse.ArgumentParser(description='Convert a tab-separated index file into a binary spectrum index')
+    parser.add_argument('-i','--input_scans', type = Path, help='Tab-separated index file')
+    parser.add_argument('-o','--output_index', type = Path, help='Binary index file, defaults to the input with a {} suffix'.format(BINARY_INDEX_SUFFIX))
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+def main():
+    args = arguments()
+    convert_scans_file(args.input_scans, args.output_index)
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,12 @@
 import argparse
 import sys
 from pathlib import Path
-import xmltodict
-from collections import defaultdict
 
-def parse_xml_file(input_filename):
-    key_value_pairs = defaultdict(list)
-    xml_obj = xmltodict.parse(open(input_filename).read())
+import proteosafe_params
 
-    for parameter in xml_obj["parameters"]["parameter"]:
-        name = parameter["@name"]
-        value = parameter["#text"]
-        key_value_pairs[name].append(value)
-
-    return key_value_pairs
-
-def get_mangled_file_mapping(parsed_paramxml):
-    all_mappings = parsed_paramxml["upload_file_mapping"]
+def get_mangled_file_mapping(upload_file_mapping):
     mangled_mapping = {}
-    for mapping in all_mappings:
-        splits = mapping.split("|")
-        mangled_name = splits[0]
-        original_name = splits[1]
+    for mangled_name, original_name in upload_file_mapping:
         mangled_mapping[Path(mangled_name).stem] = original_name
 
     return mangled_mapping
@@ -38,8 +23,7 @@ def arguments():
 def main():
     args = arguments()
 
-    proteosafe_args = parse_xml_file(args.proteosafe_paramxml)
-    mangled_mapping = get_mangled_file_mapping(proteosafe_args)
+    mangled_mapping = get_mangled_file_mapping(proteosafe_params.read_upload_file_mapping(args.proteosafe_paramxml))
 
     err_messages = []
 
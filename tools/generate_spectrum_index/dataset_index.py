@@ -0,0 +1,369 @@
+import argparse
+import fcntl
+import struct
+import sys
+import tempfile
+import uuid
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+import binary_index
+import file_copy
+import file_utils
+import generate_spectrum_index
+
+IndexedSpectrum = namedtuple('IndexedSpectrum', 'file nativeid row mslevel ms2plusindex')
+
+SHARD_SUFFIX = '.dsidx'
+SHARD_LIST = 'shards.txt'
+# Writers hold this lock exclusively while they change shards.txt, readers shared while they open the shards
+SHARD_LIST_LOCK = 'shards.lock'
+
+# Rows are held in memory until a shard is written, a file is never split across shards
+DEFAULT_SHARD_ROWS = 1000000
+
+# A bulk query reads all native IDs of a file once it asks for at least one in this many of its spectra
+BULK_READ_RATIO = 64
+
+# Little-endian layout, sections are aligned to their item size:
+#   header                                  magic, spectrum count, file count, native ID bytes, file name bytes
+#   file starts        int64[files + 1]     rows of file i are starts[i]:starts[i + 1]
+#   file name offsets  int64[files + 1]     name of file i is names[offsets[i]:offsets[i + 1]]
+#   native ID offsets  int64[count + 1]
+#   row                int64[count]         row of the spectrum in the .scans file of its file
+#   ms2plusindex       int64[count]
+#   mslevel            int16[count]
+#   file name data     utf-8 bytes
+#   native ID data     utf-8 bytes
+# Files are sorted by name and the rows of a file by native ID bytes, then row
+MAGIC = b'SPECDSI1'
+HEADER = struct.Struct('<8sQQQQ')
+
+def get_shard_name():
+    # Unique, so builders working on the same index never write the same shard, the order is kept in shards.txt
+    return 'shard-{}{}'.format(uuid.uuid4().hex, SHARD_SUFFIX)
+
+@contextmanager
+def lock_shard_list(index_folder, shared=False):
+    lock_path = Path(index_folder).joinpath(SHARD_LIST_LOCK)
+    try:
+        lock_file = open(lock_path, 'r' if shared else 'a')
+    except FileNotFoundError:
+        if shared:
+            # Nothing has been written to the index yet
+            yield
+            return
+        raise
+    with lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+def read_shard_names(index_folder):
+    # Oldest shard first, a file in a newer shard replaces the same file in older shards
+    shard_list = Path(index_folder).joinpath(SHARD_LIST)
+    if not shard_list.is_file():
+        return []
+    with open(shard_list) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def write_shard_names(index_folder, shard_names):
+    def write(temp_path):
+        with open(temp_path, 'w') as f:
+            f.writelines(shard_name + '\n' for shard_name in shard_names)
+    file_utils.atomic_write(Path(index_folder).joinpath(SHARD_LIST), write)
+
+def write_shard(files, output_shard):
+    # files are (file name, spectra) with spectra as (native ID bytes, row, mslevel, ms2plusindex) in any order
+    import numpy as np
+
+    file_names = []
+    file_starts = [0]
+    native_ids = []
+    rows = []
+    ms_levels = []
+    ms2plus_indexes = []
+    for file_name, spectra in sorted(files, key=lambda file: file[0].encode('utf-8')):
+        file_names.append(file_name.encode('utf-8'))
+        for native_id, row, ms_level, ms2plus_index in sorted(spectra):
+            native_ids.append(native_id)
+            rows.append(row)
+            ms_levels.append(ms_level)
+            ms2plus_indexes.append(ms2plus_index)
+        file_starts.append(len(native_ids))
+    count = len(native_ids)
+
+    file_name_offsets = np.zeros(len(file_names) + 1, dtype='<i8')
+    np.cumsum([len(file_name) for file_name in file_names], out=file_name_offsets[1:])
+    native_id_offsets = np.zeros(count + 1, dtype='<i8')
+    np.cumsum([len(native_id) for native_id in native_ids], out=native_id_offsets[1:])
+
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, count, len(file_names), int(native_id_offsets[-1]), int(file_name_offsets[-1])))
+            f.write(np.asarray(file_starts, dtype='<i8').tobytes())
+            f.write(file_name_offsets.tobytes())
+            f.write(native_id_offsets.tobytes())
+            f.write(np.asarray(rows, dtype='<i8').tobytes())
+            f.write(np.asarray(ms2plus_indexes, dtype='<i8').tobytes())
+            f.write(np.asarray(ms_levels, dtype='<i2').tobytes())
+            f.write(b''.join(file_names))
+            f.write(b''.join(native_ids))
+    file_utils.atomic_write(Path(output_shard), write)
+
+def _write_shards(index_folder, files, shard_rows):
+    # Files are packed into shards of up to shard_rows spectra, returns the names of the written shards
+    shard_names = []
+    pending = []
+    pending_rows = 0
+    def flush():
+        shard_name = get_shard_name()
+        write_shard(pending, Path(index_folder).joinpath(shard_name))
+        shard_names.append(shard_name)
+    for file_name, spectra in files:
+        spectra = list(spectra)
+        if pending and pending_rows + len(spectra) > shard_rows:
+            flush()
+            pending = []
+            pending_rows = 0
+        pending.append((file_name, spectra))
+        pending_rows += len(spectra)
+    if pending:
+        flush()
+    return shard_names
+
+def read_scans_spectra(scans_file):
+    for row, (native_id, ms_level, ms2plus_index) in enumerate(binary_index.read_scans_file(scans_file)):
+        yield native_id.encode('utf-8'), row, ms_level, ms2plus_index
+
+def add_files(index_folder, files, shard_rows=DEFAULT_SHARD_ROWS):
+    # files are (file name, spectra), they replace any older version of the same files without rewriting other shards
+    new_shard_names = _write_shards(index_folder, files, shard_rows)
+    # Shards are complete before they are listed, so readers never see a partial shard
+    _append_shard_names(index_folder, new_shard_names)
+    return new_shard_names
+
+def _append_shard_names(index_folder, new_shard_names):
+    with lock_shard_list(index_folder):
+        write_shard_names(index_folder, read_shard_names(index_folder) + new_shard_names)
+
+def get_scans_files(scans_folder):
+    # File name of each .scans file in an output folder of generate_spectrum_index, the input path without its first folder
+    scans_folder = Path(scans_folder)
+    scans_files = {}
+    for scans_file in sorted(scans_folder.rglob('*.scans')):
+        scans_files[scans_file.relative_to(scans_folder).with_suffix('').as_posix()] = scans_file
+    return scans_files
+
+def add_scans_folder(index_folder, scans_folder, shard_rows=DEFAULT_SHARD_ROWS):
+    scans_files = get_scans_files(scans_folder)
+    return add_files(index_folder, ((file_name, read_scans_spectra(scans_file)) for file_name, scans_file in scans_files.items()), shard_rows)
+
+def add_spectrum_files(index_folder, input_spectra, shard_rows=DEFAULT_SHARD_ROWS, default_ms_level='0', engine='stream', workers=1):
+    # Spectrum files are indexed into a temporary folder first, files that fail to index are reported and left out
+    with tempfile.TemporaryDirectory() as output_folder:
+        results = generate_spectrum_index.index_spectrum_files(input_spectra, Path(output_folder), default_ms_level, engine=engine, workers=workers, raise_errors=False)
+        scans_files = {'/'.join(result.input_spectrum.parts[1:]): result.output for result in results if not result.error}
+        return add_files(index_folder, ((file_name, read_scans_spectra(scans_file)) for file_name, scans_file in scans_files.items()), shard_rows)
+
+def merge_index(index_folder, other_index_folder):
+    # Shards of the other index are copied after the shards of this one, so their files take precedence
+    new_shard_names = []
+    with lock_shard_list(other_index_folder, shared=True):
+        for other_shard_name in read_shard_names(other_index_folder):
+            shard_name = get_shard_name()
+            def write(temp_path):
+                file_copy.copyfile(Path(other_index_folder).joinpath(other_shard_name), temp_path)
+            file_utils.atomic_write(Path(index_folder).joinpath(shard_name), write)
+            new_shard_names.append(shard_name)
+    _append_shard_names(index_folder, new_shard_names)
+    return new_shard_names
+
+def compact(index_folder, shard_rows=DEFAULT_SHARD_ROWS):
+    # Rewrites the current version of every file into new shards, rows replaced by newer shards are dropped
+    dataset_index = DatasetIndex(index_folder)
+    compacted_shard_names = dataset_index.shard_names
+    new_shard_names = _write_shards(index_folder, ((file_name, dataset_index.iter_file_spectra(file_name)) for file_name in dataset_index.files), shard_rows)
+    with lock_shard_list(index_folder):
+        shard_names = read_shard_names(index_folder)
+        if not set(compacted_shard_names) <= set(shard_names):
+            # Another compaction replaced these shards in the meantime
+            for shard_name in new_shard_names:
+                Path(index_folder).joinpath(shard_name).unlink()
+            return []
+        # Shards added while this one was compacting stay after it, so their files still take precedence
+        write_shard_names(index_folder, new_shard_names + [shard_name for shard_name in shard_names if shard_name not in compacted_shard_names])
+        # Readers that already opened the old shards keep their memory maps, new readers wait for the lock
+        for shard_name in compacted_shard_names:
+            Path(index_folder).joinpath(shard_name).unlink()
+    return new_shard_names
+
+class IndexShard:
+    # One memory-mapped shard, rows are located by file and native ID with a binary search
+
+    def __init__(self, shard_file):
+        import numpy as np
+        self._data = np.memmap(shard_file, dtype=np.uint8, mode='r')
+        magic, count, file_count, native_id_size, file_name_size = HEADER.unpack(self._data[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError('{} is not a dataset index shard'.format(shard_file))
+        position = HEADER.size
+        file_starts = self._data[position:position + 8 * (file_count + 1)].view('<i8')
+        position += 8 * (file_count + 1)
+        file_name_offsets = self._data[position:position + 8 * (file_count + 1)].view('<i8')
+        position += 8 * (file_count + 1)
+        self._offsets = self._data[position:position + 8 * (count + 1)].view('<i8')
+        position += 8 * (count + 1)
+        self.row = self._data[position:position + 8 * count].view('<i8')
+        position += 8 * count
+        self.ms2plusindex = self._data[position:position + 8 * count].view('<i8')
+        position += 8 * count
+        self.mslevel = self._data[position:position + 2 * count].view('<i2')
+        position += 2 * count
+        file_names = self._data[position:position + file_name_size].tobytes()
+        position += file_name_size
+        self._native_ids = self._data[position:position + native_id_size]
+        # File names are few, they are decoded once
+        self.file_rows = {}
+        for file_index in range(file_count):
+            file_name = file_names[file_name_offsets[file_index]:file_name_offsets[file_index + 1]].decode('utf-8')
+            self.file_rows[file_name] = (int(file_starts[file_index]), int(file_starts[file_index + 1]))
+
+    def __len__(self):
+        return len(self.row)
+
+    def native_id_bytes(self, shard_row):
+        return self._native_ids[self._offsets[shard_row]:self._offsets[shard_row + 1]].tobytes()
+
+    def read_native_ids(self, start, stop):
+        offsets = self._offsets[start:stop + 1]
+        native_ids = self._native_ids[offsets[0]:offsets[-1]].tobytes()
+        offsets = (offsets - offsets[0]).tolist()
+        return [native_ids[offsets[index]:offsets[index + 1]] for index in range(stop - start)]
+
+    def search(self, native_id, start, stop):
+        # First shard row in start:stop whose native ID is not below native_id, given as bytes
+        while start < stop:
+            middle = (start + stop) // 2
+            if self.native_id_bytes(middle) < native_id:
+                start = middle + 1
+            else:
+                stop = middle
+        return start
+
+    def iter_spectra(self, start, stop):
+        # Rows as stored, (native ID bytes, row, mslevel, ms2plusindex)
+        for shard_row in range(start, stop):
+            yield self.native_id_bytes(shard_row), int(self.row[shard_row]), int(self.mslevel[shard_row]), int(self.ms2plusindex[shard_row])
+
+    def get_spectrum(self, file_name, shard_row):
+        return IndexedSpectrum(file_name, self.native_id_bytes(shard_row).decode('utf-8'), int(self.row[shard_row]), int(self.mslevel[shard_row]), int(self.ms2plusindex[shard_row]))
+
+class DatasetIndex:
+    # Spectra of every file in a dataset by (file, nativeID), the file names are those of the .scans files
+
+    def __init__(self, index_folder):
+        self.index_folder = Path(index_folder)
+        with lock_shard_list(index_folder, shared=True):
+            self.shard_names = read_shard_names(index_folder)
+            self._shards = [IndexShard(self.index_folder.joinpath(shard_name)) for shard_name in self.shard_names]
+        self._file_shards = {}
+        for shard in self._shards:
+            for file_name in shard.file_rows:
+                self._file_shards[file_name] = shard
+
+    @property
+    def files(self):
+        return sorted(self._file_shards)
+
+    def __contains__(self, file_name):
+        return file_name in self._file_shards
+
+    def __len__(self):
+        spectra = 0
+        for file_name, shard in self._file_shards.items():
+            start, stop = shard.file_rows[file_name]
+            spectra += stop - start
+        return spectra
+
+    def iter_file(self, file_name):
+        # Spectra of the file in native ID order
+        shard = self._file_shards[file_name]
+        start, stop = shard.file_rows[file_name]
+        for shard_row in range(start, stop):
+            yield shard.get_spectrum(file_name, shard_row)
+
+    def iter_file_spectra(self, file_name):
+        shard = self._file_shards[file_name]
+        return shard.iter_spectra(*shard.file_rows[file_name])
+
+    def get(self, file_name, native_id):
+        return self.get_many([(file_name, native_id)])[0]
+
+    def get_many(self, keys):
+        # IndexedSpectrum of each (file, nativeID) in keys, None where there is none
+        results = [None] * len(keys)
+        file_queries = defaultdict(list)
+        for position, (file_name, native_id) in enumerate(keys):
+            file_queries[file_name].append((native_id.encode('utf-8'), position))
+        for file_name, queries in file_queries.items():
+            shard = self._file_shards.get(file_name)
+            if shard is None:
+                continue
+            start, stop = shard.file_rows[file_name]
+            if len(queries) * BULK_READ_RATIO >= stop - start:
+                first_rows = {}
+                for shard_row, native_id in enumerate(shard.read_native_ids(start, stop), start):
+                    first_rows.setdefault(native_id, shard_row)
+                for native_id, position in queries:
+                    shard_row = first_rows.get(native_id)
+                    if shard_row is not None:
+                        results[position] = shard.get_spectrum(file_name, shard_row)
+                continue
+            # Queries are looked up in native ID order, so each search starts where the previous one ended
+            for native_id, position in sorted(queries):
+                start = shard.search(native_id, start, stop)
+                if start < stop and shard.native_id_bytes(start) == native_id:
+                    results[position] = shard.get_spectrum(file_name, start)
+        return results
+
+def arguments():
+    parser = argparse.ArgumentParser(description='Build, extend and merge a sharded index of the spectra of a whole dataset by file and nativeID')
+    parser.add_argument('-o','--index_folder', type = Path, help='Folder of the dataset index shards')
+    parser.add_argument('-f','--scans_folder', type = Path, help='Output folder of generate_spectrum_index.py, its tab-separated index files are added')
+    parser.add_argument('-s','--input_list', type = Path, help='List of paths to spectra, they are indexed and added')
+    parser.add_argument('-m','--merge_index', type = Path, nargs='+', help='Other dataset index folders, their shards are added in the given order')
+    parser.add_argument('-c','--compact', dest='compact', action='store_true', help='Flag to rewrite all shards into new ones, without the rows of files that were added again later')
+    parser.add_argument('-r','--shard_rows', type = int, help='Maximum number of spectra per shard, unless a single file has more', default=DEFAULT_SHARD_ROWS)
+    parser.add_argument('-l','--default_ms_level', type = str, help='Default MSlevel for --input_list', default='0')
+    parser.add_argument('-g','--engine', type = str, choices = generate_spectrum_index.ENGINES, help='Parser used for mzML and mzXML files of --input_list', default='stream')
+    parser.add_argument('-w','--workers', type = int, help='Number of spectrum files of --input_list to index in parallel', default=1)
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+def main():
+    args = arguments()
+    args.index_folder.mkdir(parents=True, exist_ok=True)
+
+    # New files are added in the order given, a later source replaces the same files of an earlier one
+    for other_index_folder in args.merge_index or []:
+        merge_index(args.index_folder, other_index_folder)
+
+    if args.scans_folder:
+        add_scans_folder(args.index_folder, args.scans_folder, args.shard_rows)
+
+    if args.input_list:
+        with open(args.input_list) as f:
+            input_spectra = [Path(l.rstrip()) for l in f]
+        add_spectrum_files(args.index_folder, input_spectra, args.shard_rows, args.default_ms_level, args.engine, args.workers)
+
+    if args.compact:
+        compact(args.index_folder, args.shard_rows)
+
+    dataset_index = DatasetIndex(args.index_folder)
+    print("{} spectra of {} files in {} shards.".format(len(dataset_index), len(dataset_index.files), len(dataset_index.shard_names)))
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 from pathlib import Path
-import xmltodict
 import argparse
 from csv import DictReader
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
 import sys
-import shutil
+
+import file_copy
+import proteosafe_params
 
 def arguments():
     parser = argparse.ArgumentParser(description='Demangle collection as aliases to folder')
@@ -16,36 +19,36 @@ def arguments():
     parser.add_argument('-r','--reverse', dest='reverse', action='store_true', help='Flag to demangle file collection')
     parser.add_argument('-s','--preserve_suffix', dest='preserve_suffix', action='store_true', help='Flag to save suffix from demangled file collection')
     parser.add_argument('-c','--copy', dest='copy', action='store_true', help='Flag to copy files into destination instead of symlink them')
+    parser.add_argument('-w','--workers', type = int, help='Number of files linked or copied concurrently', default=8)
     return parser.parse_args()
 
 def read_params(input_file, mangled_prefix):
-    return get_mangled_file_mapping(parse_xml_file(input_file),mangled_prefix)
+    return get_mangled_file_mapping(proteosafe_params.read_upload_file_mapping(input_file),mangled_prefix)
 
-def get_mangled_file_mapping(params, mangled_prefix):
-    all_mappings = params["upload_file_mapping"]
+def get_mangled_file_mapping(upload_file_mapping, mangled_prefix):
     mangled_mapping = {}
     demangled_mapping = {}
-    for mapping in all_mappings:
-        splits = mapping.split("|")
-        mangled_name = splits[0]
-        original_name = splits[1]
+    for mangled_name, original_name in upload_file_mapping:
         if mangled_prefix in mangled_name:
             mangled_mapping[mangled_name] = Path(original_name)
             demangled_mapping[original_name] = Path(mangled_name)
     return mangled_mapping, demangled_mapping
 
-def parse_xml_file(input_file):
-    with open(input_file) as f:
-        key_value_pairs = defaultdict(list)
-        xml_obj = xmltodict.parse(f.read())
-
-        #print(json.dumps(xml_obj["parameters"]))
-        for parameter in xml_obj["parameters"]["parameter"]:
-            name = parameter["@name"]
-            value = parameter["#text"]
-            key_value_pairs[name].append(value)
-
-    return key_value_pairs
+def walk_files(folder):
+    # Files below folder in sorted order, like rglob symlinked folders are not followed but symlinked files are listed
+    with os.scandir(folder) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_files(entry.path)
+        elif entry.is_file():
+            yield Path(entry.path)
+
+def link_file(input_path, output_path, copy=False):
+    if not copy:
+        output_path.symlink_to(input_path)
+    else:
+        file_copy.copyfile(input_path, output_path)
 
 def main():
 
@@ -56,39 +59,39 @@ def main():
         print("Input folder, output folder, params, and collection prefix are required.")
         sys.exit(0)
     mangled_mapping, demangled_mapping = read_params(args.params, args.input_mangled_prefix)
-    output_list = None
-
-    if args.output_list:
-        output_list = open(args.output_list, 'w')
 
-    for input_file in args.input_folder.rglob('*'):
+    input_paths = []
+    output_paths = []
 
-        if input_file.is_file():
+    for input_file in walk_files(args.input_folder):
 
-            input_path = args.input_folder.joinpath('/'.join(input_file.parts[1:])).absolute()
+        input_path = args.input_folder.joinpath('/'.join(input_file.parts[1:])).absolute()
 
-            if args.reverse:
-                if args.preserve_suffix:
-                    suffix = input_file.suffix
-                    input_file_str_no_suffix = '/'.join(input_file.with_suffix('').parts[1:])
-                    output_file = demangled_mapping.get(input_file_str_no_suffix).with_suffix(suffix)
-                else:
-                    output_file = demangled_mapping.get('/'.join(input_file.parts[1:]))
+        if args.reverse:
+            if args.preserve_suffix:
+                suffix = input_file.suffix
+                input_file_str_no_suffix = '/'.join(input_file.with_suffix('').parts[1:])
+                output_file = demangled_mapping.get(input_file_str_no_suffix).with_suffix(suffix)
             else:
-                output_file = mangled_mapping.get(input_file.name)
+                output_file = demangled_mapping.get('/'.join(input_file.parts[1:]))
+        else:
+            output_file = mangled_mapping.get(input_file.name)
 
-            output_path = args.output_folder.joinpath(output_file)
-            output_path.parent.mkdir(parents=True, exist_ok=True)
-            if not args.copy:
-                output_path.symlink_to(input_path)
-            else:
-                shutil.copyfile(input_path, output_path)
+        input_paths.append(input_path)
+        output_paths.append(args.output_folder.joinpath(output_file))
 
-            if output_list:
-                output_list.write('{}\n'.format(output_path))
+    # each output folder is created once, then files are linked or copied concurrently
+    for output_folder in sorted(set(output_path.parent for output_path in output_paths)):
+        output_folder.mkdir(parents=True, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for _ in executor.map(partial(link_file, copy=args.copy), input_paths, output_paths):
+            pass
 
-    if output_list:
-        output_list.close()
+    if args.output_list:
+        with open(args.output_list, 'w') as output_list:
+            for output_path in output_paths:
+                output_list.write('{}\n'.format(output_path))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,44 @@
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl that shares the extents of another file on copy-on-write filesystems (btrfs, XFS, OCFS2)
+FICLONE = 0x40049409
+
+def _reflink(source_file, destination_file):
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+
+def _copy_file_range(source_file, destination_file):
+    # The kernel copies the data, NFS 4.2 and CIFS servers copy it without sending it over the network
+    remaining = os.fstat(source_file.fileno()).st_size
+    while remaining > 0:
+        copied = os.copy_file_range(source_file.fileno(), destination_file.fileno(), remaining)
+        if copied == 0:
+            # Some filesystems copy nothing rather than fail, the caller starts over with a plain copy
+            raise OSError('copy_file_range stopped with {} bytes left'.format(remaining))
+        remaining -= copied
+
+def copyfile(source, destination):
+    # Same result as shutil.copyfile, using the cheapest copy the filesystems support
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        for copy_data in (_reflink, _copy_file_range):
+            try:
+                copy_data(source_file, destination_file)
+                return
+            except (OSError, AttributeError):
+                # os.copy_file_range is missing outside Linux, start over with the next method
+                source_file.seek(0)
+                destination_file.seek(0)
+                destination_file.truncate()
+        shutil.copyfileobj(source_file, destination_file)
+
+def copy(source, destination):
+    # Same result as shutil.copy for file destinations
+    copyfile(source, destination)
+    shutil.copymode(source, destination)
@@ -0,0 +1,78 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+
+FileCost = namedtuple('FileCost', 'seconds memory')
+RunUsage = namedtuple('RunUsage', 'files seconds busy_seconds workers')
+
+# Rough bytes of spectrum file indexed per second by one stream or indexed worker, from benchmark_spectrum_index.py
+# runs, gzip sizes are compressed sizes. Estimates only order and pack the files, nothing is stopped when they are off
+READ_RATES = {'.mzml': 50e6, '.mzxml': 50e6, '.mzml.gz': 15e6, '.mgf': 50e6, '.mgf.gz': 25e6}
+# pyteomics decodes every peak array, about this many times slower than the stream parser
+PYTEOMICS_SLOWDOWN = 12
+
+# Memory of a worker process with its parsers loaded, and per byte of input for what grows with the file
+# (the spectrum offsets of the indexed engine, whole spectra of pyteomics)
+WORKER_MEMORY = 64 * 1024 * 1024
+MEMORY_PER_BYTE = {'stream': 0.002, 'indexed': 0.01, 'pyteomics': 0.01}
+
+def estimate_file_cost(input_spectrum, input_filetype, engine='stream', block_workers=1):
+    try:
+        size = os.stat(input_spectrum).st_size
+    except OSError:
+        # Missing files fail fast
+        size = 0
+    if input_filetype not in READ_RATES:
+        # Unknown filetypes fail fast as well
+        return FileCost(0, WORKER_MEMORY)
+    if input_filetype in ('.mgf', '.mgf.gz'):
+        # The mgf scanner is used whichever engine is asked for
+        engine = 'stream'
+    seconds = size / READ_RATES[input_filetype]
+    memory = WORKER_MEMORY + size * MEMORY_PER_BYTE[engine]
+    if engine == 'pyteomics':
+        seconds *= PYTEOMICS_SLOWDOWN
+    elif input_filetype == '.mzml.gz' and block_workers > 1:
+        # Blocked gzip files are scanned by block_workers more processes
+        seconds /= block_workers
+        memory += block_workers * WORKER_MEMORY
+    return FileCost(seconds, memory)
+
+def _run_timed(function, argument):
+    start = time.perf_counter()
+    result = function(argument)
+    return result, time.perf_counter() - start
+
+def run_largest_first(executor, workers, function, arguments, costs, max_memory=None):
+    # Longest files start first so the run does not end waiting on one large file, smaller ones fill the remaining
+    # workers and memory. A file over max_memory on its own still runs, once nothing else is running.
+    # Results are returned in the order of arguments, with the time the workers were busy
+    pending = sorted(range(len(arguments)), key=lambda index: costs[index].seconds, reverse=True)
+    results = [None] * len(arguments)
+    running = {}
+    memory_in_use = 0
+    busy_seconds = 0
+    start = time.perf_counter()
+    while pending or running:
+        while pending and len(running) < workers:
+            index = next((index for index in pending if max_memory is None or memory_in_use + costs[index].memory <= max_memory), None)
+            if index is None:
+                if running:
+                    break
+                index = pending[0]
+            pending.remove(index)
+            running[executor.submit(_run_timed, function, arguments[index])] = index
+            memory_in_use += costs[index].memory
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = running.pop(future)
+            memory_in_use -= costs[index].memory
+            results[index], seconds = future.result()
+            busy_seconds += seconds
+    return results, RunUsage(len(arguments), time.perf_counter() - start, busy_seconds, workers)
+
+def format_usage(usage):
+    capacity = usage.seconds * usage.workers
+    return "Indexed {} files in {:.1f} s, {} workers were busy {:.0%} of the time ({} cores available).".format(
+        usage.files, usage.seconds, usage.workers, usage.busy_seconds / capacity if capacity else 0, os.cpu_count())
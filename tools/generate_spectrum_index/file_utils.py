@@ -0,0 +1,53 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+PROC_STATUS = '/proc/self/status'
+
+_umask = None
+_umask_lock = threading.Lock()
+
+def _get_umask():
+    # Read once, from /proc where possible, os.umask can only read it by briefly changing it for the whole process
+    global _umask
+    with _umask_lock:
+        if _umask is None:
+            try:
+                with open(PROC_STATUS) as f:
+                    _umask = next(int(line.split()[1], 8) for line in f if line.startswith('Umask:'))
+            except (OSError, StopIteration, ValueError, IndexError):
+                _umask = os.umask(0)
+                os.umask(_umask)
+        return _umask
+
+def atomic_write(path, write):
+    # Write into a temporary file next to path and rename it, so readers never see a partial file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.' + path.name + '.')
+    try:
+        os.close(handle)
+        write(temp_path)
+        # mkstemp creates private files, cache entries and outputs get the usual permissions instead
+        os.chmod(temp_path, 0o666 & ~_get_umask())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def get_file_digest(path):
+    # sha256 of the content, read in blocks so large files are not loaded whole
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def clear_element(element):
+    # Drop a finished lxml element and its already parsed siblings, so iterparse memory stays flat
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
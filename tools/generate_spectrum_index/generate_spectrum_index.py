@@ -1,12 +1,62 @@
-from pyteomics import mzxml, mzml, mgf
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import csv
 import argparse
 import sys
 from pathlib import Path
 import gzip
+import importlib
+import re
+import zlib
+
+import binary_index
+import file_scheduler
+import file_utils
+import index_client
+import index_metrics
+import run_manifest
+import scans_cache
 
 Spectrum = namedtuple('Spectrum', 'nativeid mslevel ms2plusindex')
+IndexResult = namedtuple('IndexResult', 'input_spectrum output error digest')
+
+# Bump whenever the index output for the same input changes, cached index files of older versions are not reused
+PARSER_VERSION = '1'
+
+XML_FILETYPES = ('.mzxml', '.mzml', '.mzml.gz')
+MGF_FILETYPES = ('.mgf', '.mgf.gz')
+
+# Reader module and function per input filetype and engine, modules are imported on first use so a job only
+# loads the parsers of its own files (pyteomics in particular takes longer to import than a small file to index)
+XML_READERS = {
+    'stream': ('xml_readers', 'read_stream'),
+    'indexed': ('xml_readers', 'read_indexed'),
+    'pyteomics': ('pyteomics_readers', 'read_pyteomics')
+}
+# The mgf scanner only reads ion block parameters, whichever engine is asked for
+MGF_READERS = {engine: ('mgf_reader', 'read_mgf_spectra') for engine in XML_READERS}
+READERS = {
+    '.mzxml': XML_READERS,
+    '.mzml': XML_READERS,
+    '.mzml.gz': XML_READERS,
+    '.mgf': MGF_READERS,
+    '.mgf.gz': MGF_READERS
+}
+
+ENGINES = list(XML_READERS)
+
+# Start of the file, after decompression, that is checked for the root element or the first ion block
+SNIFF_SIZE = 4096
+GZIP_MAGIC = b'\x1f\x8b'
+SNIFF_PATTERNS = [
+    (re.compile(rb'<(?:indexedmzML|mzML)[\s>]'), '.mzml'),
+    (re.compile(rb'<mzXML[\s>]'), '.mzxml'),
+    (re.compile(rb'^[ \t]*BEGIN IONS', re.M), '.mgf')
+]
+
+# Output rows are buffered in blocks of this size
+WRITE_BUFFER_SIZE = 1024 * 1024
 
 def arguments():
     parser = argparse.ArgumentParser(description='Generate index from spectrum file')
@@ -15,8 +65,225 @@ def arguments():
     parser.add_argument('-o','--output_folder', type = Path, help='Folder to write out tab-separated index file to write out')
     parser.add_argument('-l','--default_ms_level', type = str, help='Default MSlevel', default='0')
     parser.add_argument('-e','--error_folder', type = Path, help='Write error file to this folder')
+    parser.add_argument('-w','--workers', type = int, help='Number of spectrum files to index in parallel', default=1)
+    parser.add_argument('-b','--block_workers', type = int, help='Number of processes scanning one blocked (BGZF) mzML.gz file in parallel', default=1)
+    parser.add_argument('-y','--max_memory', type = float, help='Memory in GB the files indexed in parallel may take together by their estimates, larger files are started first')
+    parser.add_argument('-c','--cache_folder', type = Path, help='Folder of the content-addressed cache of index files, checked before and filled after parsing')
+    parser.add_argument('-z','--cache_size', type = float, help='Maximum size of the index file cache in GB, least recently used files are evicted')
+    parser.add_argument('-x','--binary_index', dest='binary_index', action='store_true', help='Flag to also write a memory-mappable binary index ({}) next to each tab-separated index file'.format(binary_index.BINARY_INDEX_SUFFIX))
+    parser.add_argument('-n','--incremental', dest='incremental', action='store_true', help='Flag to only index files that are new or changed since the run recorded in the manifest')
+    parser.add_argument('-m','--manifest', type = Path, help='Run manifest used by --incremental, defaults to <output_folder>.manifest.tsv next to the output folder')
+    parser.add_argument('-t','--metrics', type = Path, help='Append a JSON line per spectrum file with its size, type, spectra, time per phase, bytes read, peak memory and cache use to this file')
+    parser.add_argument('-p','--profile_folder', type = Path, help='Write a cProfile dump (.prof) per spectrum file to this folder')
+    parser.add_argument('-d','--daemon_socket', type = Path, help='Send the files to the indexing daemon (index_daemon.py) listening on this Unix socket, index here if it is not running')
+    parser.add_argument('-g','--engine', type = str, choices = ENGINES, help='Parser used for mzML and mzXML (stream skips peak arrays, indexed seeks to each spectrum using the file index and falls back to stream, pyteomics decodes full spectra)', default='stream')
     return parser.parse_args()
 
+def get_input_filetype(input_spectrum):
+    input_suffixes = [suffix.lower() for suffix in input_spectrum.suffixes]
+    if '.mzml' in input_suffixes:
+        if '.gz' in input_suffixes:
+            input_filetype = '.mzml.gz'
+        else:
+            input_filetype = '.mzml'
+    elif '.mgf' in input_suffixes:
+        if '.gz' in input_suffixes:
+            input_filetype = '.mgf.gz'
+        else:
+            input_filetype = '.mgf'
+    elif '.mzxml' in input_suffixes:
+        input_filetype = '.mzxml'
+    else:
+        input_filetype = ''.join(input_suffixes)
+    return input_filetype.lower()
+
+def sniff_input_filetype(input_spectrum):
+    # Filetype from the file content, None when it can't be read or is not recognized
+    try:
+        with open(input_spectrum, 'rb') as spectrum_file:
+            compressed = spectrum_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+            spectrum_file.seek(0)
+            if compressed:
+                with gzip.open(spectrum_file, 'rb') as gzip_file:
+                    start = gzip_file.read(SNIFF_SIZE)
+            else:
+                start = spectrum_file.read(SNIFF_SIZE)
+    except (OSError, EOFError, zlib.error):
+        return None
+    for pattern, input_filetype in SNIFF_PATTERNS:
+        if pattern.search(start):
+            return input_filetype + '.gz' if compressed else input_filetype
+    return None
+
+def detect_input_filetype(input_spectrum):
+    # The content wins when a reader exists for it, so misnamed files (e.g. gzipped .mzML) still get the right one
+    input_filetype = sniff_input_filetype(input_spectrum)
+    if input_filetype in READERS:
+        return input_filetype
+    return get_input_filetype(input_spectrum)
+
+def get_reader(input_filetype, engine):
+    module_name, function_name = READERS[input_filetype][engine]
+    return getattr(importlib.import_module(module_name), function_name)
+
+def read_spectra(input_spectrum, input_filetype, default_ms_level='0', engine='stream', block_workers=1):
+    # (nativeID, MS level) of each spectrum in file order
+    return get_reader(input_filetype, engine)(input_spectrum, input_filetype, default_ms_level, block_workers)
+
+def index_spectra(input_spectrum, input_filetype, default_ms_level='0', engine='stream', block_workers=1):
+    # Spectra are yielded one at a time so memory does not grow with the file
+
+    # Initialize MS2+ index at 0
+    ms2plus_scan_idx = 0
+
+    if input_filetype in XML_FILETYPES:
+        for native_id, ms_level in read_spectra(input_spectrum, input_filetype, default_ms_level, engine, block_workers):
+            yield Spectrum(native_id,ms_level,-1 if ms_level <= 1 else ms2plus_scan_idx)
+            # Increment MS2+ counter, if spectrum was MS2+
+            if ms_level > 1:
+                ms2plus_scan_idx += 1
+    elif input_filetype in MGF_FILETYPES:
+        all_scan_idx = 0
+        for native_id, ms_level in read_spectra(input_spectrum, input_filetype, default_ms_level, engine, block_workers):
+            yield Spectrum(native_id,ms_level,-1 if ms_level == 1 else ms2plus_scan_idx)
+
+            # In the highly unlikely chance that there are MS1 scans in the MGF increment global scan idx
+            all_scan_idx += 1
+
+            if ms_level > 1:
+                ms2plus_scan_idx += 1
+        # Check if there are extra scans, that aren't MS2+
+        if ms2plus_scan_idx < all_scan_idx:
+            print("MS1s found in MGF file, proceed with caution!")
+
+def write_index(spectra, output):
+    # Rows go straight to a temporary file that replaces output once complete, so an error never leaves a partial
+    # index behind, and an output hardlinked to the index file cache is replaced rather than written through
+    def write(temp_path):
+        with open(temp_path, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+            csv.writer(f, delimiter = '\t').writerows(spectra)
+    file_utils.atomic_write(Path(output), write)
+
+def _use_cache(cache_operation, *args):
+    # The cache only saves work, a broken cache must not fail the indexing
+    try:
+        return cache_operation(*args)
+    except OSError as e:
+        print("Index file cache not used: {}".format(repr(e)), file=sys.stderr)
+        return False
+
+def get_output_path(input_spectrum, output_folder):
+    #Apache FilenameUtils.getBaseName method just takes off the
+    #last extension so to match the downstream code,
+    #we just remove the final suffix
+    return Path(output_folder).joinpath('/'.join(input_spectrum.with_suffix(input_spectrum.suffix + '.scans').parts[1:]))
+
+def index_spectrum_file(input_spectrum, output_folder, default_ms_level='0', error_folder=None, engine='stream', raise_errors=True, block_workers=1, cache_folder=None, record_digest=False, write_binary_index=False, metrics_file=None, profile_folder=None):
+    if not (metrics_file or profile_folder):
+        return _index_spectrum_file(input_spectrum, output_folder, default_ms_level, error_folder, engine, raise_errors, block_workers, cache_folder, record_digest, write_binary_index)
+    profile_output = Path(profile_folder).joinpath('/'.join(input_spectrum.parts[1:]) + '.prof') if profile_folder else None
+    metrics = index_metrics.FileMetrics(input_spectrum, get_input_filetype(input_spectrum), engine)
+    with metrics.measure(metrics_file, profile_output):
+        result = _index_spectrum_file(input_spectrum, output_folder, default_ms_level, error_folder, engine, raise_errors, block_workers, cache_folder, record_digest, write_binary_index, metrics)
+        metrics.record['error'] = result.error
+    return result
+
+def _index_spectrum_file(input_spectrum, output_folder, default_ms_level, error_folder, engine, raise_errors, block_workers, cache_folder, record_digest, write_binary_index, metrics=None):
+    input_filetype = detect_input_filetype(input_spectrum)
+    if metrics:
+        metrics.record['filetype'] = input_filetype
+
+    output = get_output_path(input_spectrum, output_folder)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output_err = _get_error_output(input_spectrum, error_folder)
+
+    if input_filetype not in READERS:
+        error = "{}: Unknown filetype ({}).".format('/'.join(input_spectrum.parts[1:]),input_filetype)
+    else:
+        try:
+            cache_params = (PARSER_VERSION, input_filetype, default_ms_level)
+            with index_metrics.measure_phase(metrics, 'cache_fetch'):
+                cache_hit = cache_folder and _use_cache(scans_cache.fetch_cached_scans, cache_folder, input_spectrum, output, cache_params)
+            if cache_hit:
+                if metrics:
+                    metrics.set_cache_hit(output)
+            else:
+                spectra = index_spectra(input_spectrum, input_filetype, default_ms_level, engine, block_workers)
+                with index_metrics.measure_phase(metrics, 'write'):
+                    write_index(metrics.count_spectra(spectra) if metrics else spectra, output)
+                if cache_folder:
+                    with index_metrics.measure_phase(metrics, 'cache_store'):
+                        _use_cache(scans_cache.store_cached_scans, cache_folder, input_spectrum, output, cache_params)
+            if write_binary_index:
+                with index_metrics.measure_phase(metrics, 'binary_index'):
+                    binary_index.convert_scans_file(output)
+            digest = None
+            if record_digest:
+                with index_metrics.measure_phase(metrics, 'digest'):
+                    digest = scans_cache.get_content_digest(input_spectrum, cache_folder)
+            return IndexResult(input_spectrum, output, None, digest)
+        except Exception as e:
+            if not output_err and raise_errors:
+                raise Exception(e)
+            error = "{}: {}".format('/'.join(input_spectrum.parts[1:]),repr(e))
+
+    _report_error(error, output_err, raise_errors)
+    return IndexResult(input_spectrum, None, error, None)
+
+def _get_error_output(input_spectrum, error_folder):
+    # Error files mirror the input path, the error folder is only used when it exists
+    if error_folder and Path(error_folder).is_dir():
+        output_err = Path(error_folder).joinpath('/'.join(input_spectrum.parts[1:]))
+        output_err.parent.mkdir(parents=True, exist_ok=True)
+        return output_err
+    return None
+
+def _report_error(error, output_err, raise_errors):
+    if output_err:
+        with open(output_err, 'w') as w_err:
+            w_err.write(error)
+    elif raise_errors:
+        raise Exception(error)
+    else:
+        print(error, file=sys.stderr)
+
+def _index_spectrum_files_in_daemon(daemon_socket, input_spectra, **options):
+    options = {key: str(value) if isinstance(value, Path) else value for key, value in options.items()}
+    return [IndexResult(Path(result['input_spectrum']), Path(result['output']) if result['output'] else None, result['error'], result['digest']) for result in index_client.submit_job(daemon_socket, input_spectra, options)]
+
+def index_spectrum_files(input_spectra, output_folder, default_ms_level='0', error_folder=None, engine='stream', workers=1, raise_errors=True, block_workers=1, cache_folder=None, cache_size=None, record_digest=False, write_binary_index=False, metrics_file=None, profile_folder=None, daemon_socket=None, max_memory=None):
+    results = None
+    if daemon_socket:
+        try:
+            results = _index_spectrum_files_in_daemon(daemon_socket, input_spectra, output_folder=output_folder, default_ms_level=default_ms_level, engine=engine, block_workers=block_workers, cache_folder=cache_folder, record_digest=record_digest, write_binary_index=write_binary_index, metrics_file=metrics_file, profile_folder=profile_folder)
+        except OSError as e:
+            # The daemon only saves startup time, index here when it is not running
+            print("Indexing daemon not used: {}".format(repr(e)), file=sys.stderr)
+        else:
+            # The daemon's workers only return errors, they are reported here as in a local run, also for a worker
+            # that was killed before it could report anything
+            for result in results:
+                if result.error:
+                    _report_error(result.error, _get_error_output(result.input_spectrum, error_folder), raise_errors)
+    if results is None:
+        index_file = partial(index_spectrum_file, output_folder=output_folder, default_ms_level=default_ms_level, error_folder=error_folder, engine=engine, raise_errors=raise_errors, block_workers=block_workers, cache_folder=cache_folder, record_digest=record_digest, write_binary_index=write_binary_index, metrics_file=metrics_file, profile_folder=profile_folder)
+        results = _index_spectrum_files_here(index_file, input_spectra, engine, workers, block_workers, max_memory)
+    if cache_folder and cache_size:
+        # Once per run, walking the whole cache for every stored file would cost more than the indexing
+        _use_cache(scans_cache.evict_cached_scans, cache_folder, int(cache_size * 1e9))
+    return results
+
+def _index_spectrum_files_here(index_file, input_spectra, engine, workers, block_workers, max_memory):
+    if workers <= 1 or len(input_spectra) <= 1:
+        return [index_file(input_spectrum) for input_spectrum in input_spectra]
+    costs = [file_scheduler.estimate_file_cost(input_spectrum, get_input_filetype(input_spectrum), engine, block_workers) for input_spectrum in input_spectra]
+    max_memory = int(max_memory * 1e9) if max_memory else None
+    # Errors are caught per file inside the workers, so one bad file does not stop the others
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results, usage = file_scheduler.run_largest_first(executor, workers, index_file, input_spectra, costs, max_memory)
+    print(file_scheduler.format_usage(usage))
+    return results
+
 def main():
     # don't fail on error, since it is likely to be run without inputs
     args = arguments()
@@ -35,225 +302,37 @@ def main():
             for l in f:
                 input_spectra.append(Path(l.rstrip()))
 
+    if not args.incremental:
+        index_spectrum_files(input_spectra, args.output_folder, args.default_ms_level, args.error_folder, args.engine, args.workers, block_workers=args.block_workers, cache_folder=args.cache_folder, cache_size=args.cache_size, write_binary_index=args.binary_index, metrics_file=args.metrics, profile_folder=args.profile_folder, daemon_socket=args.daemon_socket, max_memory=args.max_memory)
+        return
+
+    manifest_path = args.manifest or run_manifest.get_manifest_path(args.output_folder)
+    manifest = run_manifest.read_manifest(manifest_path)
+
+    changed_spectra = []
     for input_spectrum in input_spectra:
-        input_suffixes = [suffix.lower() for suffix in input_spectrum.suffixes]
-        if '.mzml' in input_suffixes:
-            if '.gz' in input_suffixes:
-                input_filetype = '.mzml.gz'
-            else:
-                input_filetype = '.mzml'
-        elif '.mgf' in input_suffixes:
-            if '.gz' in input_suffixes:
-                input_filetype = '.mgf.gz'
-            else:
-                input_filetype = '.mgf'
-        elif '.mzxml' in input_suffixes:
-            input_filetype = '.mzxml'
-        else:
-            input_filetype = ''.join(input_suffixes)
-
-        #Apache FilenameUtils.getBaseName method just takes off the
-        #last extension so to match the downstream code,
-        #we just remove the final suffix
-
-        output = Path(args.output_folder).joinpath('/'.join(input_spectrum.with_suffix(input_spectrum.suffix + '.scans').parts[1:]))
-        output.parent.mkdir(parents=True, exist_ok=True)
-        input_filetype = input_filetype.lower()
-        if args.error_folder and args.error_folder.is_dir():
-            output_err = Path(args.error_folder).joinpath('/'.join(input_spectrum.parts[1:]))
-            output_err.parent.mkdir(parents=True, exist_ok=True)
+        entry = manifest.get(str(input_spectrum))
+        output = get_output_path(input_spectrum, args.output_folder)
+        if run_manifest.is_unchanged(entry, input_spectrum, output, PARSER_VERSION, args.default_ms_level, args.cache_folder):
+            # Refresh size and mtime, the file may have been touched without changing
+            manifest[str(input_spectrum)] = run_manifest.get_manifest_entry(input_spectrum, output, entry['digest'], PARSER_VERSION, args.default_ms_level)
         else:
-            output_err = None
-        # List of output spectra
-        spectra = []
-
-        # Initialize MS2+ index at 0
-        ms2plus_scan_idx = 0
-
-        # In the highly unlikely chance that there are MS1 scans in the MGF set warning flag
-        mgf_ms1_warn = False
-
-        if input_filetype == '.mzxml':
-            try:
-                with open(input_spectrum, 'rb') as mzxml_file:
-                    with mzxml.read(mzxml_file, huge_tree=True) as reader:
-                        for s in reader:
-                            # Always use scan= for nativeID for mzXML
-                            spectra.append(Spectrum('scan={}'.format(s['num']),int(s['msLevel']),-1 if int(s['msLevel']) <= 1 else ms2plus_scan_idx))
-                            # Increment MS2+ counter, if spectrum was MS2+
-                            if int(s.get('msLevel',2)) > 1:
-                                ms2plus_scan_idx += 1
-            except Exception as e:
-                if output_err:
-                    with open(output_err, 'w') as w_err:
-                        w_err.write("{}: {}".format('/'.join(input_spectrum.parts[1:]),repr(e)))
-                    sys.exit(0)
-                else:
-                    raise Exception(e)
-        elif input_filetype == '.mzml':
-            try:
-                with open(input_spectrum, 'rb') as mzml_file:
-                    mzml_object = mzml.read(mzml_file, huge_tree=True)
-                    param_groups = {}
-                    for ref in mzml_object.iterfind("referenceableParamGroupList/referenceableParamGroup"):
-                        param_groups[ref['id']] = ref
-                with open(input_spectrum, 'rb') as mzml_file:
-                    with mzml.read(mzml_file, huge_tree=True) as reader:
-                        for s in reader:
-                            ms_level = s.get('ms level')
-                            if not ms_level:
-                                spec_param_group = s.get('ref')
-                                if spec_param_group:
-                                    ms_level = param_groups[spec_param_group].get('ms level')
-                                else:
-                                    ms_level = args.default_ms_level
-                            # Always use given nativeID for mzML
-                            spectra.append(Spectrum(s['id'],int(ms_level),-1 if int(ms_level) <= 1 else ms2plus_scan_idx))
-                            # Increment MS2+ counter, if spectrum was MS2+
-                            if int(ms_level) > 1:
-                                ms2plus_scan_idx += 1
-            except Exception as e:
-                if output_err:
-                    with open(output_err, 'w') as w_err:
-                        w_err.write("{}: {}".format('/'.join(input_spectrum.parts[1:]),repr(e)))
-                    sys.exit(0)
-                else:
-                    raise Exception(e)
-        elif input_filetype == '.mzml.gz':
-            try:
-                with gzip.open(input_spectrum, 'rb') as mzmlgz_file:
-                    mzml_object = mzml.read(mzmlgz_file, huge_tree=True)
-                    param_groups = {}
-                    for ref in mzml_object.iterfind("referenceableParamGroupList/referenceableParamGroup"):
-                        param_groups[ref['id']] = ref
-                with gzip.open(input_spectrum, 'rb') as mzmlgz_file:
-                    with mzml.read(mzmlgz_file, huge_tree=True) as reader:
-                        for s in reader:
-                            ms_level = s.get('ms level')
-                            if not ms_level:
-                                spec_param_group = s.get('ref')
-                                if spec_param_group:
-                                    ms_level = param_groups[spec_param_group].get('ms level')
-                                else:
-                                    ms_level = args.default_ms_level
-                            # Always use given nativeID for mzML
-                            spectra.append(Spectrum(s['id'],int(ms_level),-1 if int(ms_level) <= 1 else ms2plus_scan_idx))
-                            # Increment MS2+ counter, if spectrum was MS2+
-                            if int(ms_level) > 1:
-                                ms2plus_scan_idx += 1
-            except Exception as e:
-                if output_err:
-                    with open(output_err, 'w') as w_err:
-                        w_err.write("{}: {}".format('/'.join(input_spectrum.parts[1:]),repr(e)))
-                    sys.exit(0)
-                else:
-                    raise Exception(e)
-        elif input_filetype == '.mgf':
-            # try to parse this mgf file with the pyteomics library
-            try:
-                all_scan_idx = 0
-                with open(input_spectrum) as mgf_file:
-                    with mgf.read(mgf_file) as reader:
-                        for s in reader:
-                            # Check for MSLEVEL but assume 2
-                            ms_level = int(s['params'].get('mslevel', 2))
-
-                            scan_num = s['params'].get('scans')
-                            if scan_num:
-                                # If SCANS is in the mgf, then use scan= nativeID format
-                                native_id = ','.join('scan={}'.format(s) for s in scan_num.split(','))
-                            else:
-                                # Format as an index= nativeID
-                                native_id = 'index={}'.format(all_scan_idx)
-
-                            spectra.append(Spectrum(native_id,ms_level,-1 if ms_level == 1 else ms2plus_scan_idx))
-
-                            # In the highly unlikely chance that there are MS1 scans in the MGF increment global scan idx
-                            all_scan_idx += 1
-
-                            if ms_level > 1:
-                                ms2plus_scan_idx += 1
-            # if that didn't work, just count spectra in the file (marked by lines containing the word "BEGIN")
-            except:
-                try:
-                    ms2_count = 0
-                    with open(input_spectrum) as mgf_file:
-                        for i,line in enumerate(mgf_file):
-                            if "BEGIN" in line:
-                                ms2_count += 1
-                    # assume all spectra are MS level 2 and write out one row for each
-                    spectra = []
-                    for index in range(0, ms2_count):
-                        spectra.append(Spectrum('index={}'.format(index), 2, index))
-                except Exception as e:
-                    if output_err:
-                        with open(output_err, 'w') as w_err:
-                            w_err.write("{}: {}".format('/'.join(input_spectrum.parts[1:]),repr(e)))
-                        sys.exit(0)
-                    else:
-                        raise Exception(e)
-            # Check if there are extra scans, that aren't MS2+
-            if ms2plus_scan_idx < all_scan_idx:
-                print("MS1s found in MGF file, proceed with caution!")
-        elif input_filetype == '.mgf.gz':
-            # try to parse this mgf file with the pyteomics library
-            try:
-                all_scan_idx = 0
-                with gzip.open(input_spectrum, 'rt') as mgf_gz_file:
-                    with mgf.read(mgf_gz_file) as reader:
-                        for s in reader:
-                            # Check for MSLEVEL but assume 2
-                            ms_level = int(s['params'].get('mslevel', 2))
-
-                            scan_num = s['params'].get('scans')
-                            if scan_num:
-                                # If SCANS is in the mgf, then use scan= nativeID format
-                                native_id = ','.join('scan={}'.format(s) for s in scan_num.split(','))
-                            else:
-                                # Format as an index= nativeID
-                                native_id = 'index={}'.format(all_scan_idx)
-
-                            spectra.append(Spectrum(native_id,ms_level,-1 if ms_level == 1 else ms2plus_scan_idx))
-
-                            # In the highly unlikely chance that there are MS1 scans in the MGF increment global scan idx
-                            all_scan_idx += 1
-
-                            if ms_level > 1:
-                                ms2plus_scan_idx += 1
-            # if that didn't work, just count spectra in the file (marked by lines containing the word "BEGIN")
-            except:
-                try:
-                    ms2_count = 0
-                    with gzip.open(input_spectrum, 'rt') as mgf_gz_file:
-                        for i,line in enumerate(mgf_gz_file):
-                            if "BEGIN" in line:
-                                ms2_count += 1
-                    # assume all spectra are MS level 2 and write out one row for each
-                    spectra = []
-                    for index in range(0, ms2_count):
-                        spectra.append(Spectrum('index={}'.format(index), 2, index))
-                except Exception as e:
-                    if output_err:
-                        with open(output_err, 'w') as w_err:
-                            w_err.write("{}: {}".format('/'.join(input_spectrum.parts[1:]),repr(e)))
-                        sys.exit(0)
-                    else:
-                        raise Exception(e)
-            # Check if there are extra scans, that aren't MS2+
-            if ms2plus_scan_idx < all_scan_idx:
-                print("MS1s found in MGF file, proceed with caution!")
+            changed_spectra.append(input_spectrum)
+    print("{} of {} spectrum files are new or changed.".format(len(changed_spectra), len(input_spectra)))
+
+    # Errors are collected rather than raised, so the files that did index are recorded in the manifest first
+    results = index_spectrum_files(changed_spectra, args.output_folder, args.default_ms_level, args.error_folder, args.engine, args.workers, raise_errors=False, block_workers=args.block_workers, cache_folder=args.cache_folder, cache_size=args.cache_size, record_digest=True, write_binary_index=args.binary_index, metrics_file=args.metrics, profile_folder=args.profile_folder, daemon_socket=args.daemon_socket, max_memory=args.max_memory)
+    for result in results:
+        # Failed files are left out so the next run tries them again
+        if result.error:
+            manifest.pop(str(result.input_spectrum), None)
         else:
-            if output_err:
-                with open(output_err, 'w') as w_err:
-                    w_err.write("{}: Unknown filetype ({}).".format('/'.join(input_spectrum.parts[1:]),input_filetype))
-                sys.exit(0)
-            else:
-                raise Exception("{}: Unknown filetype ({}).".format('/'.join(input_spectrum.parts[1:]),input_filetype))
+            manifest[str(result.input_spectrum)] = run_manifest.get_manifest_entry(result.input_spectrum, result.output, result.digest, PARSER_VERSION, args.default_ms_level)
+    run_manifest.write_manifest(manifest_path, manifest)
 
-        with open(output, 'w') as f:
-            r = csv.writer(f, delimiter = '\t')
-            for spectrum in spectra:
-                r.writerow(list(spectrum))
+    # Without an error folder a failed file fails the run, as it does outside incremental mode
+    if any(result.error for result in results) and not (args.error_folder and args.error_folder.is_dir()):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
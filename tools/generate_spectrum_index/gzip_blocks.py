@@ -0,0 +1,106 @@
+import gzip
+import struct
+import zlib
+from pathlib import Path
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+GZIP_FLAG_FEXTRA = 4
+GZIP_HEADER_SIZE = 12
+
+# Chunks handed to one worker are about this many compressed bytes
+GZIP_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Uncompressed bytes per block written by compress_bgzf, bgzip uses the same size
+BGZF_BLOCK_SIZE = 0xff00
+
+def read_bgzf_blocks(gzip_file):
+    # Walk the BGZF block headers, the BC extra subfield holds the size of each block
+    blocks = []
+    offset = 0
+    while True:
+        gzip_file.seek(offset)
+        header = gzip_file.read(GZIP_HEADER_SIZE)
+        if not header:
+            return blocks
+        if len(header) < GZIP_HEADER_SIZE or header[:3] != GZIP_MAGIC or not header[3] & GZIP_FLAG_FEXTRA:
+            return None
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = gzip_file.read(extra_length)
+        block_size = None
+        position = 0
+        while position + 4 <= len(extra):
+            subfield_id = extra[position:position + 2]
+            subfield_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+            if subfield_id == b'BC' and subfield_length == 2:
+                block_size = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+            position += 4 + subfield_length
+        if block_size is None:
+            return None
+        blocks.append((offset, block_size))
+        offset += block_size
+
+def read_gzi_blocks(gzi_path, file_size):
+    # bgzip -i layout: entry count, then (compressed offset, uncompressed offset) for every block after the first
+    gzi_data = Path(gzi_path).read_bytes()
+    if len(gzi_data) < 8:
+        return None
+    entry_count = struct.unpack('<Q', gzi_data[:8])[0]
+    if len(gzi_data) != 8 + 16 * entry_count:
+        return None
+    offsets = [0] + [struct.unpack_from('<Q', gzi_data, 8 + 16 * entry)[0] for entry in range(entry_count)]
+    offsets.append(file_size)
+    blocks = []
+    for start, end in zip(offsets, offsets[1:]):
+        if end <= start:
+            return None
+        blocks.append((start, end - start))
+    return blocks
+
+def get_gzip_blocks(input_spectrum):
+    # An existing .gzi seek index is used as is, otherwise BGZF files are indexed from their block headers
+    file_size = Path(input_spectrum).stat().st_size
+    gzi_path = Path(str(input_spectrum) + '.gzi')
+    if gzi_path.is_file():
+        blocks = read_gzi_blocks(gzi_path, file_size)
+        if blocks:
+            return blocks
+    with open(input_spectrum, 'rb') as gzip_file:
+        return read_bgzf_blocks(gzip_file)
+
+def read_blocks(gzip_file, blocks):
+    # Blocks are consecutive gzip members, which gzip.decompress handles in one call
+    offset = blocks[0][0]
+    gzip_file.seek(offset)
+    return gzip.decompress(gzip_file.read(blocks[-1][0] + blocks[-1][1] - offset))
+
+def split_blocks(blocks, min_chunks=1, chunk_size=GZIP_CHUNK_SIZE):
+    # Contiguous (start, stop) block ranges of roughly equal compressed size
+    total_size = sum(block_size for _, block_size in blocks)
+    chunk_count = max(min_chunks, -(-total_size // chunk_size))
+    target_size = total_size / chunk_count
+    chunks = []
+    start = 0
+    current_size = 0
+    for index, (_, block_size) in enumerate(blocks):
+        current_size += block_size
+        if current_size >= target_size:
+            chunks.append((start, index + 1))
+            start = index + 1
+            current_size = 0
+    if start < len(blocks):
+        chunks.append((start, len(blocks)))
+    return chunks
+
+def compress_bgzf(data, block_size=BGZF_BLOCK_SIZE):
+    # BGZF blocks are gzip members with a BC extra subfield, followed by the empty end-of-file block
+    compressed = []
+    for start in range(0, len(data), block_size):
+        compressed.append(_compress_bgzf_block(data[start:start + block_size]))
+    compressed.append(_compress_bgzf_block(b''))
+    return b''.join(compressed)
+
+def _compress_bgzf_block(block):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(block) + compressor.flush()
+    header = GZIP_MAGIC + struct.pack('<BIBBHccHH', GZIP_FLAG_FEXTRA, 0, 0, 255, 6, b'B', b'C', 2, GZIP_HEADER_SIZE + 6 + len(deflated) + 8 - 1)
+    return header + deflated + struct.pack('<II', zlib.crc32(block), len(block))
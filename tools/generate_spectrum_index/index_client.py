@@ -0,0 +1,27 @@
+import json
+import os
+import socket
+
+# The daemon sends an empty line at least every third of this many seconds while a job runs
+HEARTBEAT_TIMEOUT = 60
+
+def submit_job(daemon_socket, input_spectra, options):
+    # One JSON request line out, one JSON response line back once every file of the job is indexed
+    request = {
+        'cwd': os.getcwd(),
+        'input_spectra': [str(input_spectrum) for input_spectrum in input_spectra],
+        'options': options
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        # A daemon that is stuck or gone raises socket.timeout, an OSError, rather than blocking the client
+        connection.settimeout(HEARTBEAT_TIMEOUT)
+        connection.connect(str(daemon_socket))
+        connection.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        connection.shutdown(socket.SHUT_WR)
+        with connection.makefile('rb') as response_file:
+            response = response_file.readline()
+            while response == b'\n':
+                response = response_file.readline()
+    if not response:
+        raise ConnectionError('Indexing daemon at {} closed the connection without a response'.format(daemon_socket))
+    return json.loads(response)['results']
@@ -0,0 +1,170 @@
+import argparse
+import heapq
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+
+import generate_spectrum_index
+import index_client
+
+# Options of index_spectrum_file that are paths, the client sends them as strings
+PATH_OPTIONS = ('output_folder', 'error_folder', 'cache_folder', 'metrics_file', 'profile_folder')
+
+# Clients take the daemon as stuck when a job sends nothing for index_client.HEARTBEAT_TIMEOUT seconds
+HEARTBEAT_INTERVAL = index_client.HEARTBEAT_TIMEOUT / 3
+
+def arguments():
+    parser = argparse.ArgumentParser(description='Resident spectrum index service, jobs are sent by generate_spectrum_index.py and massive_wrapper.py with --daemon_socket')
+    parser.add_argument('-u','--socket', type = Path, help='Unix socket to listen on')
+    parser.add_argument('-w','--workers', type = int, help='Number of worker processes shared by all jobs', default=os.cpu_count())
+    if len(sys.argv) < 2:
+        parser.print_help()
+        sys.exit(1)
+    return parser.parse_args()
+
+def index_in_folder(cwd, input_spectrum, options):
+    # Jobs come from clients in different folders, relative paths are resolved against the client's folder
+    os.chdir(cwd)
+    options = {key: Path(value) if key in PATH_OPTIONS and value is not None else value for key, value in options.items()}
+    # Errors are returned to the client rather than raised in the worker
+    return generate_spectrum_index.index_spectrum_file(Path(input_spectrum), raise_errors=False, **options)
+
+def get_reader_modules():
+    # generate_spectrum_index imports its readers on first use, the daemon loads all of them up front
+    return sorted({module_name for readers in generate_spectrum_index.READERS.values() for module_name, _ in readers.values()})
+
+class IndexScheduler:
+    # Hands queued files to a fixed pool of warm workers, smallest file first across all jobs
+
+    def __init__(self, workers):
+        self._workers = workers
+        self._executor = self._start_executor()
+        self._free_workers = threading.Semaphore(workers)
+        self._queue = []
+        self._queue_condition = threading.Condition()
+        self._sequence = itertools.count()
+        self._dispatch_thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatch_thread.start()
+
+    def _start_executor(self):
+        # forkserver workers are started from a clean process with the parsers already imported,
+        # so they are warm and safe to start from this multi-threaded server
+        mp_context = multiprocessing.get_context('forkserver')
+        mp_context.set_forkserver_preload(['generate_spectrum_index', 'numpy'] + get_reader_modules())
+        executor = ProcessPoolExecutor(max_workers=self._workers, mp_context=mp_context)
+        for _ in range(self._workers):
+            executor.submit(os.getpid)
+        return executor
+
+    def is_running(self):
+        return self._dispatch_thread.is_alive()
+
+    def submit(self, cwd, input_spectrum, options):
+        try:
+            size = os.stat(os.path.join(cwd, input_spectrum)).st_size
+        except OSError:
+            # Missing files fail fast in the worker
+            size = 0
+        future = Future()
+        with self._queue_condition:
+            heapq.heappush(self._queue, (size, next(self._sequence), cwd, input_spectrum, options, future))
+            self._queue_condition.notify()
+        return future
+
+    def _dispatch(self):
+        while True:
+            self._free_workers.acquire()
+            with self._queue_condition:
+                while not self._queue:
+                    self._queue_condition.wait()
+                _, _, cwd, input_spectrum, options, future = heapq.heappop(self._queue)
+            try:
+                worker_future = self._submit(cwd, input_spectrum, options)
+            except Exception as e:
+                self._free_workers.release()
+                future.set_exception(e)
+                continue
+            worker_future.add_done_callback(partial(self._finish, future))
+
+    def _submit(self, cwd, input_spectrum, options):
+        try:
+            return self._executor.submit(index_in_folder, cwd, input_spectrum, options)
+        except BrokenProcessPool:
+            # A worker died (killed for memory, crashed in a parser), the files it and the other workers were
+            # indexing have failed with BrokenProcessPool, the queued ones go to a new pool
+            print("Worker pool broken, starting new workers.", file=sys.stderr)
+            self._executor.shutdown(wait=False)
+            self._executor = self._start_executor()
+            return self._executor.submit(index_in_folder, cwd, input_spectrum, options)
+
+    def _finish(self, future, worker_future):
+        self._free_workers.release()
+        try:
+            future.set_result(worker_future.result())
+        except Exception as e:
+            future.set_exception(e)
+
+class IndexRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        futures = [self.server.scheduler.submit(request['cwd'], input_spectrum, request['options']) for input_spectrum in request['input_spectra']]
+        results = []
+        for input_spectrum, future in zip(request['input_spectra'], futures):
+            # Empty lines tell the client the daemon is alive while a file takes long
+            while not wait([future], timeout=HEARTBEAT_INTERVAL).done:
+                if not self.server.scheduler.is_running():
+                    # Closing without a response sends the client back to indexing the files itself
+                    return
+                self.wfile.write(b'\n')
+            try:
+                result = future.result()
+                results.append({
+                    'input_spectrum': str(result.input_spectrum),
+                    'output': str(result.output) if result.output else None,
+                    'error': result.error,
+                    'digest': result.digest
+                })
+            except Exception as e:
+                # The worker itself failed, e.g. it was killed, worded like the errors of the files themselves
+                results.append({'input_spectrum': input_spectrum, 'output': None, 'error': '{}: {}'.format('/'.join(Path(input_spectrum).parts[1:]), repr(e)), 'digest': None})
+        self.wfile.write((json.dumps({'results': results}) + '\n').encode('utf-8'))
+
+class IndexServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, workers):
+        self.scheduler = IndexScheduler(workers)
+        super().__init__(str(socket_path), IndexRequestHandler)
+
+def main():
+    args = arguments()
+    if args.socket.is_socket():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(str(args.socket))
+                print("An indexing daemon is already listening on {}.".format(args.socket))
+                sys.exit(1)
+            except ConnectionRefusedError:
+                # Left behind by a daemon that was killed, it would block the bind
+                args.socket.unlink()
+    with IndexServer(args.socket, args.workers) as server:
+        print("Indexing daemon listening on {} with {} workers.".format(args.socket, args.workers))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            args.socket.unlink()
+
+if __name__ == "__main__":
+    main()
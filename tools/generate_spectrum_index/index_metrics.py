@@ -0,0 +1,144 @@
+import cProfile
+import json
+import os
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+PROC_STATUS = '/proc/self/status'
+PROC_IO = '/proc/self/io'
+PROC_THREAD_IO = '/proc/thread-self/io'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+def _read_proc_field(proc_file, field):
+    try:
+        with open(proc_file) as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key == field:
+                    return int(value.split()[0])
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _reset_peak_memory():
+    # Writing 5 to clear_refs resets the peak RSS of this process on Linux, so worker processes get a peak per file
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def get_peak_memory():
+    peak_memory = _read_proc_field(PROC_STATUS, 'VmHWM')
+    if peak_memory is None:
+        # Peak of the whole process so far, ru_maxrss is in kB on Linux
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_memory * 1024
+
+def _get_bytes_read(proc_io=PROC_IO):
+    # Bytes passed through read calls, pages of memory-mapped plain mgf files are not included
+    return _read_proc_field(proc_io, 'rchar')
+
+def write_metrics(metrics_file, record):
+    # One append per line, so processes indexing in parallel can share the file
+    line = (json.dumps(record) + '\n').encode('utf-8')
+    handle = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+        os.write(handle, line)
+    finally:
+        os.close(handle)
+
+def measure_phase(metrics, name):
+    return metrics.phase(name) if metrics else nullcontext()
+
+class FileMetrics:
+    # Size, spectra, time per phase, bytes read, peak memory and cache use of indexing one spectrum file
+
+    def __init__(self, input_spectrum, input_filetype, engine):
+        try:
+            size = os.stat(input_spectrum).st_size
+        except OSError:
+            size = None
+        self.record = {
+            'file': str(input_spectrum),
+            'filetype': input_filetype,
+            'size': size,
+            'engine': engine,
+            'spectra': None,
+            'cache_hit': False,
+            'seconds': None,
+            'phases': {},
+            'bytes_read': None,
+            'peak_memory': None,
+            'error': None
+        }
+
+    def _add_phase_time(self, name, seconds):
+        self.record['phases'][name] = self.record['phases'].get(name, 0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_phase_time(name, time.perf_counter() - start)
+
+    def set_cache_hit(self, output):
+        self.record['cache_hit'] = True
+        with open(output, 'rb') as f:
+            self.record['spectra'] = sum(1 for _ in f)
+
+    def count_spectra(self, spectra):
+        # The writer pulls rows out of the parser, so time spent in the parser is moved from the write phase to parse
+        spectrum_count = 0
+        parse_time = 0
+        spectra = iter(spectra)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    spectrum = next(spectra)
+                except StopIteration:
+                    break
+                finally:
+                    parse_time += time.perf_counter() - start
+                spectrum_count += 1
+                yield spectrum
+        finally:
+            self.record['spectra'] = spectrum_count
+            self._add_phase_time('parse', parse_time)
+            self._add_phase_time('write', -parse_time)
+
+    @contextmanager
+    def measure(self, metrics_file=None, profile_output=None, in_thread=False):
+        # Peak memory is per process, files handled in threads of one process leave it out and count their own reads
+        proc_io = PROC_THREAD_IO if in_thread else PROC_IO
+        if not in_thread:
+            _reset_peak_memory()
+        bytes_read = _get_bytes_read(proc_io)
+        profile = cProfile.Profile() if profile_output else None
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield self
+        except Exception as e:
+            self.record['error'] = repr(e)
+            raise
+        finally:
+            if profile:
+                profile.disable()
+            self.record['seconds'] = time.perf_counter() - start
+            end_bytes_read = _get_bytes_read(proc_io)
+            if bytes_read is not None and end_bytes_read is not None:
+                self.record['bytes_read'] = end_bytes_read - bytes_read
+            if not in_thread:
+                self.record['peak_memory'] = get_peak_memory()
+            if profile:
+                Path(profile_output).parent.mkdir(parents=True, exist_ok=True)
+                profile.dump_stats(profile_output)
+            if metrics_file:
+                write_metrics(metrics_file, self.record)
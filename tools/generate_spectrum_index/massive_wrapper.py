@@ -1,14 +1,18 @@
 import argparse
 import os
 import re
-import shutil
-import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 
-SCRIPT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
-GENERATE_SPECTRUM_INDEX_SCRIPT = os.path.join(SCRIPT_DIRECTORY, "generate_spectrum_index.py")
+import binary_index
+import file_copy
+import generate_spectrum_index
+import index_metrics
+
 MASSIVE_REPOSITORY_ROOT = "/data/massive"
+MASSIVE_PEAK_FOLDER = "ccms_metadata/ccms_peak"
 
 def arguments():
     parser = argparse.ArgumentParser(description='Generate index from MassIVE peak list file')
@@ -16,8 +20,63 @@ def arguments():
     parser.add_argument('-o','--output_folder', type=Path, help='Output directory into which to write tab-separated index file')
     parser.add_argument('-l','--default_ms_level', type=str, help='Default MS level', default='0')
     parser.add_argument('-e','--error_folder', type=Path, help='Output directory into which to write error files')
+    parser.add_argument('-w','--workers', type=int, help='Number of uncached peak list files to index in parallel', default=1)
+    parser.add_argument('-b','--block_workers', type=int, help='Number of processes scanning one blocked (BGZF) mzML.gz file in parallel', default=1)
+    parser.add_argument('-y','--max_memory', type=float, help='Memory in GB the uncached peak list files indexed in parallel may take together by their estimates, larger files are started first')
+    parser.add_argument('-c','--cache_folder', type=Path, help='Folder of the content-addressed cache of index files, checked before and filled after parsing')
+    parser.add_argument('-z','--cache_size', type=float, help='Maximum size of the index file cache in GB, least recently used files are evicted')
+    parser.add_argument('-x','--binary_index', dest='binary_index', action='store_true', help='Flag to also write a memory-mappable binary index next to each tab-separated index file')
+    parser.add_argument('-k','--copy_workers', type=int, help='Number of concurrent folder listings and cached index file copies against the MassIVE repository', default=8)
+    parser.add_argument('-d','--daemon_socket', type=Path, help='Send uncached peak list files to the indexing daemon (index_daemon.py) listening on this Unix socket, index here if it is not running')
+    parser.add_argument('-t','--metrics', type=Path, help='Append a JSON line per peak list file with its size, type, spectra, time per phase, bytes read, peak memory and cache use to this file')
+    parser.add_argument('-p','--profile_folder', type=Path, help='Write a cProfile dump (.prof) per indexed peak list file to this folder')
     return parser.parse_args()
 
+def get_cached_scans_path(input_spectrum):
+    path = input_spectrum.split("/")
+    # a valid dataset file will have at least 4 path elements:
+    # demangledPeak/<dataset>/<collection>/<rest of path>
+    if len(path) >= 4:
+        # username should be the second path element, under the "demangledPeak" collection
+        username = path[1]
+        # only dataset files can have their index files cached
+        if re.match("^MSV[0-9]{9}$", username):
+            return os.path.join(MASSIVE_REPOSITORY_ROOT, username, MASSIVE_PEAK_FOLDER, "/".join(path[3:]) + ".scans")
+    return None
+
+def list_files(folder):
+    try:
+        with os.scandir(folder) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except OSError:
+        return set()
+
+def resolve_cached_scans(input_spectra, workers):
+    # The repository is on a network filesystem, so every folder holding cached index files is listed once,
+    # concurrently, instead of checking each file on its own
+    cached_paths = {input_spectrum: get_cached_scans_path(input_spectrum) for input_spectrum in input_spectra}
+    folders = sorted({os.path.dirname(cached_path) for cached_path in cached_paths.values() if cached_path})
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        folder_files = dict(zip(folders, executor.map(list_files, folders)))
+    cached_scans_files = {}
+    for input_spectrum, cached_path in cached_paths.items():
+        if cached_path and os.path.basename(cached_path) in folder_files[os.path.dirname(cached_path)]:
+            cached_scans_files[input_spectrum] = cached_path
+    return cached_scans_files
+
+def copy_cached_scans(cached_scans_file, input_spectrum, output, write_binary_index=False, metrics_file=None):
+    # Copies run in threads, so only their own reads are measured, and only with --metrics
+    metrics = index_metrics.FileMetrics(input_spectrum, generate_spectrum_index.get_input_filetype(Path(input_spectrum)), None) if metrics_file else None
+    with metrics.measure(metrics_file, in_thread=True) if metrics else nullcontext():
+        with index_metrics.measure_phase(metrics, 'cache_fetch'):
+            output.parent.mkdir(parents=True, exist_ok=True)
+            file_copy.copy(cached_scans_file, output)
+        if metrics:
+            metrics.set_cache_hit(output)
+        if write_binary_index:
+            with index_metrics.measure_phase(metrics, 'binary_index'):
+                binary_index.convert_scans_file(output)
+
 def main():
     args = arguments()
     if not (args.input_list and args.output_folder):
@@ -27,36 +86,28 @@ def main():
     with open(args.input_list) as file_reader:
         for line in file_reader:
             input_spectra.append(line.rstrip())
-    for input_spectrum in input_spectra:
-        input_spectrum_path = Path(input_spectrum)
-        output = Path(args.output_folder).joinpath('/'.join(input_spectrum_path.with_suffix(input_spectrum_path.suffix + '.scans').parts[1:]))
-        # check for a cached index file for this spectrum file
-        cached_scans_file = None
-        path = input_spectrum.split("/")
-        # a valid dataset file will have at least 4 path elements:
-        # demangledPeak/<dataset>/<collection>/<rest of path>
-        if len(path) >= 4:
-            # username should be the second path element, under the "demangledPeak" collection
-            username = path[1]
-            # only dataset files can have their index files cached
-            if re.match("^MSV[0-9]{9}$", username):
-                # determine cached scans file location, if present in the dataset
-                cached_path = os.path.join(MASSIVE_REPOSITORY_ROOT, username, "ccms_metadata/ccms_peak", "/".join(path[3:]) + ".scans")
-                if os.path.exists(cached_path):
-                    cached_scans_file = cached_path
-        if cached_scans_file is not None:
-            print("Copying cached scans file [" + cached_scans_file + "] for input spectrum file [" + input_spectrum  + "] to intermediate location [" + str(output) + "].")
-            output.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy(cached_scans_file, str(output))
-        else:
-            print("No cached scans file cound be found for input spectrum file [" + input_spectrum  + "] - generating now.")
-            command = sys.executable + " \"" + GENERATE_SPECTRUM_INDEX_SCRIPT + "\" -i \"" + input_spectrum + "\" -o \"" + str(args.output_folder) + "\""
-            if args.error_folder:
-                command += " -e " + str(args.error_folder)
-            if args.default_ms_level:
-                command += " -l " + args.default_ms_level
-            print("Command = [" + command + "]")
-            subprocess.run(command, shell=True)
+    cached_scans_files = resolve_cached_scans(input_spectra, args.copy_workers)
+    uncached_spectra = []
+    with ThreadPoolExecutor(max_workers=args.copy_workers) as copy_executor:
+        copies = []
+        for input_spectrum in input_spectra:
+            input_spectrum_path = Path(input_spectrum)
+            output = Path(args.output_folder).joinpath('/'.join(input_spectrum_path.with_suffix(input_spectrum_path.suffix + '.scans').parts[1:]))
+            # check for a cached index file for this spectrum file
+            cached_scans_file = cached_scans_files.get(input_spectrum)
+            if cached_scans_file is not None:
+                print("Copying cached scans file [" + cached_scans_file + "] for input spectrum file [" + input_spectrum  + "] to intermediate location [" + str(output) + "].")
+                copies.append(copy_executor.submit(copy_cached_scans, cached_scans_file, input_spectrum, output, args.binary_index, args.metrics))
+            else:
+                print("No cached scans file cound be found for input spectrum file [" + input_spectrum  + "] - generating now.")
+                uncached_spectra.append(input_spectrum_path)
+        for copy in copies:
+            copy.result()
+    # the copy threads are gone before the indexer forks its worker processes
+    if uncached_spectra:
+        print("Indexing " + str(len(uncached_spectra)) + " uncached spectrum files with " + str(args.workers) + " workers.")
+        # errors are isolated per file, as they were when each file was indexed in its own process
+        generate_spectrum_index.index_spectrum_files(uncached_spectra, args.output_folder, args.default_ms_level, args.error_folder, workers=args.workers, raise_errors=False, block_workers=args.block_workers, cache_folder=args.cache_folder, cache_size=args.cache_size, write_binary_index=args.binary_index, metrics_file=args.metrics, profile_folder=args.profile_folder, daemon_socket=args.daemon_socket, max_memory=args.max_memory)
 
 if __name__ == "__main__":
     main()
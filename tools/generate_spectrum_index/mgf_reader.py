@@ -0,0 +1,78 @@
+import gzip
+import mmap
+import os
+import re
+
+# Only ion block markers and the SCANS/MSLEVEL keys are matched, peak lines are skipped inside the regex engine
+MGF_LINE_PATTERN = re.compile(rb'^[ \t]*(?:(BEGIN IONS|END IONS)[ \t]*\r?$|((?i:SCANS|MSLEVEL))=([^\r\n]*))', re.M)
+MGF_CHUNK_SIZE = 16 * 1024 * 1024
+
+def _read_mgf_buffers(input_spectrum, input_filetype):
+    if input_filetype == '.mgf.gz':
+        with gzip.open(input_spectrum, 'rb') as mgf_file:
+            remainder = b''
+            while True:
+                chunk = mgf_file.read(MGF_CHUNK_SIZE)
+                if not chunk:
+                    if remainder:
+                        yield remainder
+                    return
+                chunk = remainder + chunk
+                # Only hand out whole lines, the rest is kept for the next chunk
+                last_newline = chunk.rfind(b'\n') + 1
+                remainder = chunk[last_newline:]
+                if last_newline:
+                    yield chunk[:last_newline]
+    else:
+        with open(input_spectrum, 'rb') as mgf_file:
+            if os.fstat(mgf_file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(mgf_file.fileno(), 0, access=mmap.ACCESS_READ) as mgf_map:
+                yield mgf_map
+
+def _get_mgf_spectrum(params, all_scan_idx):
+    # Check for MSLEVEL but assume 2, also when it can't be read
+    try:
+        ms_level = int(params.get(b'mslevel', 2))
+    except ValueError:
+        ms_level = 2
+
+    scan_num = params.get(b'scans', b'').decode('utf-8', 'replace')
+    if scan_num:
+        # If SCANS is in the mgf, then use scan= nativeID format
+        native_id = ','.join('scan={}'.format(s) for s in scan_num.split(','))
+    else:
+        # Format as an index= nativeID
+        native_id = 'index={}'.format(all_scan_idx)
+    return native_id, ms_level
+
+def read_mgf_spectra(input_spectrum, input_filetype, default_ms_level='0', block_workers=1):
+    # MS levels come from MSLEVEL, so the default MS level and block workers of the XML readers are not used
+    # Parameters before the first ion block apply to every spectrum, as in pyteomics
+    header = {}
+    in_header = True
+    # Parameters of the current ion block, None between blocks
+    params = None
+    all_scan_idx = 0
+    for buffer in _read_mgf_buffers(input_spectrum, input_filetype):
+        for line in MGF_LINE_PATTERN.finditer(buffer):
+            marker, key, value = line.groups()
+            if marker == b'BEGIN IONS':
+                in_header = False
+                if params is not None:
+                    # END IONS is missing, so the previous block ends here
+                    yield _get_mgf_spectrum(params, all_scan_idx)
+                    all_scan_idx += 1
+                params = dict(header)
+            elif marker == b'END IONS':
+                if params is not None:
+                    yield _get_mgf_spectrum(params, all_scan_idx)
+                    all_scan_idx += 1
+                params = None
+            elif params is not None:
+                params[key.lower()] = value.strip()
+            elif in_header and b'=' not in value:
+                header[key.lower()] = value.strip()
+    # A block cut off by the end of the file still counts as a spectrum
+    if params is not None:
+        yield _get_mgf_spectrum(params, all_scan_idx)
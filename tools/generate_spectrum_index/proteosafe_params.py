@@ -0,0 +1,46 @@
+import json
+import sys
+from pathlib import Path
+
+from lxml import etree
+
+import file_utils
+
+# Bump whenever the cached mapping changes shape, older cache files are not reused
+MAPPING_CACHE_VERSION = '2'
+
+def iter_parameters(params_file):
+    # Stream <parameter name="...">value</parameter> pairs, finished elements are dropped so memory stays flat
+    for _, parameter in etree.iterparse(str(params_file), tag='parameter', huge_tree=True):
+        yield parameter.get('name'), (parameter.text or '').strip()
+        file_utils.clear_element(parameter)
+
+def get_mapping_cache_path(params_file, digest):
+    params_file = Path(params_file)
+    return params_file.parent.joinpath('.{}.{}.{}.mapping.json'.format(params_file.name, digest[:16], MAPPING_CACHE_VERSION))
+
+def read_upload_file_mapping(params_file, use_cache=True):
+    # (mangled name, original name) of every upload_file_mapping, cached next to params.xml under its content hash
+    # as JSON, so a cache file written by someone else is only ever read as data
+    cache_path = None
+    if use_cache:
+        cache_path = get_mapping_cache_path(params_file, file_utils.get_file_digest(params_file))
+        try:
+            with open(cache_path) as f:
+                return [(str(mangled), str(original)) for mangled, original in json.load(f)]
+        except (OSError, ValueError, TypeError):
+            pass
+
+    upload_file_mapping = []
+    for name, value in iter_parameters(params_file):
+        if name == 'upload_file_mapping':
+            splits = value.split('|')
+            upload_file_mapping.append((splits[0], splits[1]))
+
+    if cache_path:
+        try:
+            file_utils.atomic_write(cache_path, lambda temp_path: Path(temp_path).write_text(json.dumps(upload_file_mapping)))
+        except OSError as e:
+            # The cache only saves work, a read-only params.xml folder must not fail the step
+            print("Upload file mapping cache not written: {}".format(repr(e)), file=sys.stderr)
+    return upload_file_mapping
@@ -0,0 +1,62 @@
+from pyteomics import mzxml, mzml, mgf
+import gzip
+
+def read_mzxml_pyteomics(input_spectrum):
+    with open(input_spectrum, 'rb') as mzxml_file:
+        with mzxml.read(mzxml_file, huge_tree=True) as reader:
+            for s in reader:
+                # Always use scan= for nativeID for mzXML
+                yield 'scan={}'.format(s['num']), int(s['msLevel'])
+
+def read_mzml_pyteomics(input_spectrum, open_spectrum, default_ms_level):
+    with open_spectrum(input_spectrum, 'rb') as mzml_file:
+        mzml_object = mzml.read(mzml_file, huge_tree=True)
+        param_groups = {}
+        for ref in mzml_object.iterfind("referenceableParamGroupList/referenceableParamGroup"):
+            param_groups[ref['id']] = ref
+    with open_spectrum(input_spectrum, 'rb') as mzml_file:
+        with mzml.read(mzml_file, huge_tree=True) as reader:
+            for s in reader:
+                ms_level = s.get('ms level')
+                if not ms_level:
+                    spec_param_group = s.get('ref')
+                    if spec_param_group:
+                        ms_level = param_groups[spec_param_group].get('ms level')
+                    else:
+                        ms_level = default_ms_level
+                # Always use given nativeID for mzML
+                yield s['id'], int(ms_level)
+
+def read_pyteomics(input_spectrum, input_filetype, default_ms_level, block_workers=1):
+    # pyteomics decodes full spectra in this process, block_workers only apply to the stream parser
+    if input_filetype == '.mzxml':
+        return read_mzxml_pyteomics(input_spectrum)
+    open_spectrum = gzip.open if input_filetype == '.mzml.gz' else open
+    return read_mzml_pyteomics(input_spectrum, open_spectrum, default_ms_level)
+
+def read_mgf_pyteomics(input_spectrum, input_filetype):
+    # The pyteomics.mgf reader the mgf scanner replaced, kept as the reference its output is checked against
+    open_spectrum = gzip.open if input_filetype == '.mgf.gz' else open
+    try:
+        spectra = []
+        with open_spectrum(input_spectrum, 'rt') as mgf_file:
+            # Read in order, pyteomics 5 fails to build its offset index on a gzip text stream
+            with mgf.read(mgf_file, use_index=False) as reader:
+                for all_scan_idx, s in enumerate(reader):
+                    # Check for MSLEVEL but assume 2
+                    ms_level = int(s['params'].get('mslevel', 2))
+                    scan_num = s['params'].get('scans')
+                    if scan_num:
+                        # If SCANS is in the mgf, then use scan= nativeID format
+                        native_id = ','.join('scan={}'.format(s) for s in scan_num.split(','))
+                    else:
+                        # Format as an index= nativeID
+                        native_id = 'index={}'.format(all_scan_idx)
+                    spectra.append((native_id, ms_level))
+    # if that didn't work, just count spectra in the file (marked by lines containing the word "BEGIN")
+    except Exception:
+        with open_spectrum(input_spectrum, 'rt') as mgf_file:
+            ms2_count = sum(1 for line in mgf_file if "BEGIN" in line)
+        # assume all spectra are MS level 2
+        spectra = [('index={}'.format(index), 2) for index in range(ms2_count)]
+    return spectra
@@ -0,0 +1,58 @@
+import csv
+import os
+from pathlib import Path
+
+import file_utils
+import scans_cache
+
+MANIFEST_FIELDS = ['path', 'size', 'mtime', 'digest', 'parser_version', 'default_ms_level', 'output']
+
+def get_manifest_path(output_folder):
+    # The manifest sits next to the output folder, so the folder only holds index files
+    output_folder = Path(os.path.abspath(output_folder))
+    return output_folder.with_name(output_folder.name + '.manifest.tsv')
+
+def read_manifest(manifest_path):
+    manifest = {}
+    if Path(manifest_path).is_file():
+        with open(manifest_path, newline='') as f:
+            for entry in csv.DictReader(f, delimiter='\t'):
+                manifest[entry['path']] = entry
+    return manifest
+
+def write_manifest(manifest_path, manifest):
+    def write(temp_path):
+        with open(temp_path, 'w', newline='') as f:
+            w = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, delimiter='\t')
+            w.writeheader()
+            for path in sorted(manifest):
+                w.writerow(manifest[path])
+    file_utils.atomic_write(Path(manifest_path), write)
+
+def get_manifest_entry(input_spectrum, output, digest, parser_version, default_ms_level):
+    stat = os.stat(input_spectrum)
+    return {
+        'path': str(input_spectrum),
+        'size': str(stat.st_size),
+        'mtime': str(stat.st_mtime_ns),
+        'digest': digest,
+        'parser_version': parser_version,
+        'default_ms_level': default_ms_level,
+        'output': str(output)
+    }
+
+def is_unchanged(entry, input_spectrum, output, parser_version, default_ms_level, cache_folder=None):
+    if not entry or entry['parser_version'] != parser_version or entry['default_ms_level'] != default_ms_level:
+        return False
+    if entry['output'] != str(output) or not Path(output).is_file():
+        return False
+    try:
+        stat = os.stat(input_spectrum)
+    except OSError:
+        return False
+    if str(stat.st_size) != entry['size']:
+        return False
+    if str(stat.st_mtime_ns) == entry['mtime']:
+        return True
+    # Same size but touched since, the content digest decides
+    return scans_cache.get_content_digest(input_spectrum, cache_folder) == entry['digest']
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+import file_utils
+
+# Cache layout under the cache folder:
+#   objects/<digest[:2]>/<digest>.<params>.scans  index output keyed by input content and parser parameters
+#   stat/<key[:2]>/<key>                          content digest of a path with a given size and mtime
+OBJECTS_FOLDER = 'objects'
+STAT_FOLDER = 'stat'
+
+STAT_GRACE_SECONDS = 24 * 60 * 60
+
+def _sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def _stat_key(input_spectrum):
+    # Cheap pre-check, the same path with the same size and mtime is assumed to have the same content
+    stat = os.stat(input_spectrum)
+    return _sha256('{}\0{}\0{}'.format(os.path.realpath(input_spectrum), stat.st_size, stat.st_mtime_ns))
+
+def _link_or_copy(source, destination):
+    # Hardlink when cache and output share a filesystem, copy otherwise
+    try:
+        # Renaming a link over another link of the same file does nothing and would leave the temporary file behind
+        if os.path.samefile(source, destination):
+            return
+    except OSError:
+        pass
+    def write(temp_path):
+        try:
+            os.remove(temp_path)
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+    file_utils.atomic_write(Path(destination), write)
+
+def get_content_digest(input_spectrum, cache_folder=None):
+    stat_path = None
+    if cache_folder:
+        stat_key = _stat_key(input_spectrum)
+        stat_path = Path(cache_folder).joinpath(STAT_FOLDER, stat_key[:2], stat_key)
+        try:
+            digest = stat_path.read_text().strip()
+            # Touched like the index files, so eviction keeps the entries still in use
+            os.utime(stat_path)
+            return digest
+        except OSError:
+            pass
+    digest = file_utils.get_file_digest(input_spectrum)
+    if stat_path:
+        file_utils.atomic_write(stat_path, lambda temp_path: Path(temp_path).write_text(digest))
+    return digest
+
+def get_cached_path(cache_folder, digest, cache_params):
+    params_key = _sha256('\0'.join(str(param) for param in cache_params))[:16]
+    return Path(cache_folder).joinpath(OBJECTS_FOLDER, digest[:2], '{}.{}.scans'.format(digest, params_key))
+
+def fetch_cached_scans(cache_folder, input_spectrum, output, cache_params):
+    cached_path = get_cached_path(cache_folder, get_content_digest(input_spectrum, cache_folder), cache_params)
+    try:
+        _link_or_copy(cached_path, output)
+        # Touch the entry so eviction is least recently used
+        os.utime(cached_path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def store_cached_scans(cache_folder, input_spectrum, output, cache_params):
+    cached_path = get_cached_path(cache_folder, get_content_digest(input_spectrum, cache_folder), cache_params)
+    file_utils.atomic_write(cached_path, lambda temp_path: shutil.copyfile(output, temp_path))
+
+def _list_cache_entries(folder):
+    # (mtime, size, path) of the files in the prefix folders below folder
+    entries = []
+    if not folder.is_dir():
+        return entries
+    for prefix_entry in os.scandir(folder):
+        if not prefix_entry.is_dir():
+            continue
+        for entry in os.scandir(prefix_entry.path):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def _remove_entry(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def evict_cached_scans(cache_folder, max_size):
+    entries = sorted(_list_cache_entries(Path(cache_folder).joinpath(OBJECTS_FOLDER)))
+    total_size = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        _remove_entry(path)
+        total_size -= size
+        evicted += 1
+    # Digests not looked up for a while before the oldest index file still cached was used belong to files that
+    # are gone or changed, the grace keeps digests looked up just before their index file was stored
+    stat_cutoff = entries[evicted][0] - STAT_GRACE_SECONDS if evicted < len(entries) else float('inf')
+    for mtime, _, path in _list_cache_entries(Path(cache_folder).joinpath(STAT_FOLDER)):
+        if mtime < stat_cutoff:
+            _remove_entry(path)
@@ -0,0 +1,213 @@
+import base64
+import gzip
+import hashlib
+import random
+import struct
+import zlib
+from pathlib import Path
+
+import gzip_blocks
+
+# Synthetic input types, each is written to its own file named after the generation parameters
+SYNTHETIC_TYPES = ['mzML', 'indexedmzML', 'mzML.gz', 'mzXML', 'mgf', 'mgf.gz']
+
+# Peak values only depend on the seed, so the same parameters always give byte-identical files
+PEAK_SEED = 0
+
+MZML_HEADER = '''<?xml version="1.0" encoding="utf-8"?>
+{indexed_start}<mzML xmlns="http://psi.hupo.org/ms/mzml" version="1.1.0" id="synthetic">
+  <cvList count="2">
+    <cv id="MS" fullName="Proteomics Standards Initiative Mass Spectrometry Ontology" URI="https://raw.githubusercontent.com/HUPO-PSI/psi-ms-CV/master/psi-ms.obo"/>
+    <cv id="UO" fullName="Unit Ontology" URI="https://raw.githubusercontent.com/bio-ontology-research-group/unit-ontology/master/unit.obo"/>
+  </cvList>
+{param_groups}  <run id="synthetic">
+    <spectrumList count="{count}" defaultDataProcessingRef="synthetic">
+'''
+MZML_PARAM_GROUPS = '''  <referenceableParamGroupList count="2">
+    <referenceableParamGroup id="ms1">
+      <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="1"/>
+    </referenceableParamGroup>
+    <referenceableParamGroup id="ms2">
+      <cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="2"/>
+    </referenceableParamGroup>
+  </referenceableParamGroupList>
+'''
+MZML_INDEXED_START = '<indexedmzML xmlns="http://psi.hupo.org/ms/mzml">\n'
+MZML_MS_LEVEL = '<cvParam cvRef="MS" accession="MS:1000511" name="ms level" value="{}"/>'
+MZML_PARAM_GROUP_REF = '<referenceableParamGroupRef ref="ms{}"/>'
+MZML_SPECTRUM = '''      <spectrum index="{index}" id="controllerType=0 controllerNumber=1 scan={scan}" defaultArrayLength="{peaks}">
+        {ms_level}
+        <cvParam cvRef="MS" accession="MS:1000127" name="centroid spectrum" value=""/>
+        <scanList count="1">
+          <cvParam cvRef="MS" accession="MS:1000795" name="no combination" value=""/>
+          <scan>
+            <cvParam cvRef="MS" accession="MS:1000016" name="scan start time" value="{time:.4f}" unitCvRef="UO" unitAccession="UO:0000031" unitName="minute"/>
+          </scan>
+        </scanList>
+        <binaryDataArrayList count="2">
+          <binaryDataArray encodedLength="{mz_length}">
+            <cvParam cvRef="MS" accession="MS:1000523" name="64-bit float" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000574" name="zlib compression" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000514" name="m/z array" value="" unitCvRef="MS" unitAccession="MS:1000040" unitName="m/z"/>
+            <binary>{mz}</binary>
+          </binaryDataArray>
+          <binaryDataArray encodedLength="{intensity_length}">
+            <cvParam cvRef="MS" accession="MS:1000521" name="32-bit float" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000574" name="zlib compression" value=""/>
+            <cvParam cvRef="MS" accession="MS:1000515" name="intensity array" value="" unitCvRef="MS" unitAccession="MS:1000131" unitName="number of detector counts"/>
+            <binary>{intensity}</binary>
+          </binaryDataArray>
+        </binaryDataArrayList>
+      </spectrum>
+'''
+MZML_FOOTER = '''    </spectrumList>
+  </run>
+</mzML>
+'''
+
+MZXML_HEADER = '''<?xml version="1.0" encoding="ISO-8859-1"?>
+<mzXML xmlns="http://sashimi.sourceforge.net/schema_revision/mzXML_3.2">
+  <msRun scanCount="{count}">
+'''
+MZXML_SCAN = '''    <scan num="{scan}" msLevel="{ms_level}" peaksCount="{peaks}" centroided="1" retentionTime="PT{time:.4f}S">
+      <peaks precision="32" byteOrder="network" contentType="m/z-int" compressionType="zlib" compressedLen="{peaks_length}">{peak_data}</peaks>
+'''
+
+MGF_SPECTRUM = '''BEGIN IONS
+TITLE=synthetic.{scan}.{scan}.2
+PEPMASS={precursor:.4f}
+CHARGE=2+
+RTINSECONDS={time:.4f}
+SCANS={scan}
+{peak_lines}END IONS
+'''
+
+def get_ms_levels(spectra, ms2_per_ms1):
+    # One MS1 survey scan followed by ms2_per_ms1 MS2 scans, repeated
+    return [1 if index % (ms2_per_ms1 + 1) == 0 else 2 for index in range(spectra)]
+
+def _get_peaks(peaks):
+    generator = random.Random(PEAK_SEED)
+    mz = sorted(generator.uniform(100, 2000) for _ in range(peaks))
+    intensity = [generator.uniform(0, 1e6) for _ in range(peaks)]
+    return mz, intensity
+
+def _encode(data):
+    return base64.b64encode(zlib.compress(data)).decode('ascii')
+
+def write_mzml(output, ms_levels, peaks, param_groups=False, indexed=False):
+    mz, intensity = _get_peaks(peaks)
+    encoded_mz = _encode(struct.pack('<{}d'.format(peaks), *mz))
+    encoded_intensity = _encode(struct.pack('<{}f'.format(peaks), *intensity))
+
+    document = bytearray(MZML_HEADER.format(
+        indexed_start=MZML_INDEXED_START if indexed else '',
+        param_groups=MZML_PARAM_GROUPS if param_groups else '',
+        count=len(ms_levels)
+    ).encode('utf-8'))
+    offsets = []
+    for index, ms_level in enumerate(ms_levels):
+        native_id = 'controllerType=0 controllerNumber=1 scan={}'.format(index + 1)
+        offsets.append((native_id, len(document) + len('      ')))
+        document += MZML_SPECTRUM.format(
+            index=index,
+            scan=index + 1,
+            peaks=peaks,
+            ms_level=(MZML_PARAM_GROUP_REF if param_groups else MZML_MS_LEVEL).format(ms_level),
+            time=index / 60,
+            mz_length=len(encoded_mz),
+            mz=encoded_mz,
+            intensity_length=len(encoded_intensity),
+            intensity=encoded_intensity
+        ).encode('utf-8')
+    document += MZML_FOOTER.encode('utf-8')
+
+    if indexed:
+        index_offset = len(document)
+        document += b'<indexList count="1">\n  <index name="spectrum">\n'
+        for native_id, offset in offsets:
+            document += '    <offset idRef="{}">{}</offset>\n'.format(native_id, offset).encode('utf-8')
+        document += b'  </index>\n</indexList>\n'
+        document += '<indexListOffset>{}</indexListOffset>\n<fileChecksum>'.format(index_offset).encode('utf-8')
+        document += hashlib.sha1(document).hexdigest().encode('ascii')
+        document += b'</fileChecksum>\n</indexedmzML>\n'
+    Path(output).write_bytes(document)
+
+def write_mzxml(output, ms_levels, peaks):
+    mz, intensity = _get_peaks(peaks)
+    peak_data = zlib.compress(struct.pack('>{}f'.format(2 * peaks), *[value for pair in zip(mz, intensity) for value in pair]))
+    encoded_peaks = base64.b64encode(peak_data).decode('ascii')
+
+    document = bytearray(MZXML_HEADER.format(count=len(ms_levels)).encode('utf-8'))
+    offsets = []
+    open_scans = 0
+    for index, ms_level in enumerate(ms_levels):
+        # MS2 scans are nested in their MS1 survey scan, as written by msconvert and ReAdW
+        if ms_level == 1:
+            document += b'    </scan>\n' * open_scans
+            open_scans = 0
+        offsets.append((index + 1, len(document) + len('    ')))
+        document += MZXML_SCAN.format(
+            scan=index + 1,
+            ms_level=ms_level,
+            peaks=peaks,
+            time=index,
+            peaks_length=len(peak_data),
+            peak_data=encoded_peaks
+        ).encode('utf-8')
+        if ms_level == 1:
+            open_scans += 1
+        else:
+            document += b'    </scan>\n'
+    document += b'    </scan>\n' * open_scans
+    document += b'  </msRun>\n'
+
+    index_offset = len(document)
+    document += b'  <index name="scan">\n'
+    for scan, offset in offsets:
+        document += '    <offset id="{}">{}</offset>\n'.format(scan, offset).encode('utf-8')
+    document += b'  </index>\n'
+    document += '  <indexOffset>{}</indexOffset>\n  <sha1>'.format(index_offset).encode('utf-8')
+    document += hashlib.sha1(document).hexdigest().encode('ascii')
+    document += b'</sha1>\n</mzXML>\n'
+    Path(output).write_bytes(document)
+
+def write_mgf(output, ms_levels, peaks):
+    # MGF files only hold fragment spectra, MS1 scans leave gaps in the scan numbers
+    mz, intensity = _get_peaks(peaks)
+    peak_lines = ''.join('{:.4f} {:.1f}\n'.format(*peak) for peak in zip(mz, intensity))
+    document = ''.join(
+        MGF_SPECTRUM.format(scan=index + 1, precursor=mz[index % peaks], time=index, peak_lines=peak_lines)
+        for index, ms_level in enumerate(ms_levels) if ms_level > 1
+    ).encode('utf-8')
+    Path(output).write_bytes(document)
+
+def get_synthetic_path(output_folder, synthetic_type, spectra, ms2_per_ms1, param_groups):
+    name = 'synthetic_{}_{}{}'.format(spectra, ms2_per_ms1, '_groups' if param_groups and 'mzML' in synthetic_type else '')
+    if synthetic_type == 'indexedmzML':
+        return Path(output_folder).joinpath(name + '_indexed.mzML')
+    return Path(output_folder).joinpath('{}.{}'.format(name, synthetic_type))
+
+def write_synthetic_spectra(output_folder, synthetic_types=SYNTHETIC_TYPES, spectra=10000, ms2_per_ms1=4, param_groups=False, peaks=50):
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+    ms_levels = get_ms_levels(spectra, ms2_per_ms1)
+    outputs = []
+    for synthetic_type in synthetic_types:
+        output = get_synthetic_path(output_folder, synthetic_type, spectra, ms2_per_ms1, param_groups)
+        if synthetic_type == 'mzML':
+            write_mzml(output, ms_levels, peaks, param_groups)
+        elif synthetic_type == 'indexedmzML':
+            write_mzml(output, ms_levels, peaks, param_groups, indexed=True)
+        elif synthetic_type == 'mzML.gz':
+            # BGZF is plain gzip to every reader, and lets the blocked mzML.gz path be benchmarked too
+            write_mzml(output, ms_levels, peaks, param_groups)
+            output.write_bytes(gzip_blocks.compress_bgzf(output.read_bytes()))
+        elif synthetic_type == 'mzXML':
+            write_mzxml(output, ms_levels, peaks)
+        elif synthetic_type == 'mgf':
+            write_mgf(output, ms_levels, peaks)
+        elif synthetic_type == 'mgf.gz':
+            write_mgf(output, ms_levels, peaks)
+            output.write_bytes(gzip.compress(output.read_bytes(), mtime=0))
+        outputs.append(output)
+    return outputs
@@ -0,0 +1,54 @@
+import zlib
+
+import pytest
+
+import binary_index
+
+def write_index(tmp_path, spectra):
+    output_index = tmp_path.joinpath('spectra.scanidx')
+    binary_index.write_binary_index(spectra, output_index)
+    return binary_index.BinaryIndex(output_index)
+
+def test_rows_round_trip(tmp_path):
+    spectra = [('scan=1', 1, -1), ('scan=2', 2, 0), ('scan=3', 2, 1)]
+    index = write_index(tmp_path, spectra)
+    assert len(index) == 3
+    assert list(index) == spectra
+    assert index[-1] == spectra[-1]
+    with pytest.raises(IndexError):
+        index[3]
+
+def test_find_through_probe_chains(tmp_path):
+    spectra = [('controllerType=0 controllerNumber=1 scan={}'.format(scan), 2, scan) for scan in range(1000)]
+    index = write_index(tmp_path, spectra)
+    # With this many rows some native IDs share a first slot, so they are found by probing
+    mask = binary_index._get_table_size(len(spectra)) - 1
+    first_slots = [zlib.crc32(native_id.encode()) & mask for native_id, _, _ in spectra]
+    assert len(set(first_slots)) < len(first_slots)
+    for row, (native_id, _, _) in enumerate(spectra):
+        assert index.find(native_id) == row
+    assert index.find('scan=1000') is None
+    assert index.get('controllerType=0 controllerNumber=1 scan=7') == spectra[7]
+
+def test_duplicate_native_ids_find_the_first_row(tmp_path):
+    index = write_index(tmp_path, [('index=0', 2, 0), ('scan=5', 2, 1), ('index=0', 2, 2)])
+    assert index.find('index=0') == 0
+    assert index.find('scan=5') == 1
+
+def test_empty_and_non_ascii(tmp_path):
+    assert write_index(tmp_path, []).find('scan=1') is None
+    index = write_index(tmp_path, [('spectrum=é', 2, 0)])
+    assert index.get('spectrum=é') == ('spectrum=é', 2, 0)
+
+def test_convert_scans_file(tmp_path):
+    scans_file = tmp_path.joinpath('input.mzML.scans')
+    scans_file.write_text('scan=1\t1\t-1\nscan=2\t2\t0\n')
+    output_index = binary_index.convert_scans_file(scans_file)
+    assert output_index == tmp_path.joinpath('input.mzML.scanidx')
+    assert list(binary_index.BinaryIndex(output_index)) == [('scan=1', 1, -1), ('scan=2', 2, 0)]
+
+def test_not_a_binary_index(tmp_path):
+    other = tmp_path.joinpath('other.scanidx')
+    other.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError):
+        binary_index.BinaryIndex(other)
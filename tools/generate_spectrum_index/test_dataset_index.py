@@ -0,0 +1,70 @@
+import dataset_index
+from dataset_index import IndexedSpectrum
+
+def get_spectra(native_ids):
+    return [(native_id.encode('utf-8'), row, 2, row) for row, native_id in enumerate(native_ids)]
+
+def test_get_and_get_many(tmp_path):
+    scan_ids = ['scan={}'.format(scan) for scan in range(200)]
+    dataset_index.add_files(tmp_path, [('a/one.mzML', get_spectra(scan_ids)), ('a/two.mgf', get_spectra(['index=0', 'index=1', 'index=0']))])
+    index = dataset_index.DatasetIndex(tmp_path)
+    assert index.files == ['a/one.mzML', 'a/two.mgf']
+    assert len(index) == 203
+    assert index.get('a/one.mzML', 'scan=17') == IndexedSpectrum('a/one.mzML', 'scan=17', 17, 2, 17)
+    # Duplicate native IDs resolve to the first row
+    assert index.get('a/two.mgf', 'index=0').row == 0
+    # Few queries per file are searched, many are read in bulk, both give the same rows
+    searched = index.get_many([('a/one.mzML', 'scan=150'), ('a/one.mzML', 'scan=2'), ('a/one.mzML', 'scan=999'), ('missing.mzML', 'scan=1')])
+    assert [spectrum.row if spectrum else None for spectrum in searched] == [150, 2, None, None]
+    bulk = index.get_many([('a/one.mzML', native_id) for native_id in reversed(scan_ids)] + [('a/one.mzML', 'scan=999')])
+    assert [spectrum.row if spectrum else None for spectrum in bulk] == list(reversed(range(200))) + [None]
+
+def test_later_shards_take_precedence(tmp_path):
+    dataset_index.add_files(tmp_path, [('a/one.mzML', get_spectra(['scan=1', 'scan=2'])), ('a/two.mzML', get_spectra(['scan=1']))])
+    dataset_index.add_files(tmp_path, [('a/one.mzML', get_spectra(['scan=3']))])
+    index = dataset_index.DatasetIndex(tmp_path)
+    assert len(index.shard_names) == 2
+    assert len(index) == 2
+    assert index.get('a/one.mzML', 'scan=1') is None
+    assert index.get('a/one.mzML', 'scan=3').row == 0
+    assert index.get('a/two.mzML', 'scan=1').row == 0
+
+def test_compact_keeps_current_versions(tmp_path):
+    dataset_index.add_files(tmp_path, [('a/one.mzML', get_spectra(['scan=1', 'scan=2'])), ('a/two.mzML', get_spectra(['scan=1']))])
+    dataset_index.add_files(tmp_path, [('a/one.mzML', get_spectra(['scan=3']))])
+    old_shard_names = dataset_index.read_shard_names(tmp_path)
+    new_shard_names = dataset_index.compact(tmp_path, shard_rows=1)
+    # A file is never split, so each file gets a shard of its own
+    assert len(new_shard_names) == 2
+    assert dataset_index.read_shard_names(tmp_path) == new_shard_names
+    assert not any(tmp_path.joinpath(shard_name).exists() for shard_name in old_shard_names)
+    index = dataset_index.DatasetIndex(tmp_path)
+    assert [spectrum.nativeid for spectrum in index.iter_file('a/one.mzML')] == ['scan=3']
+    assert [spectrum.nativeid for spectrum in index.iter_file('a/two.mzML')] == ['scan=1']
+
+def test_merge_index(tmp_path):
+    index_folder = tmp_path.joinpath('index')
+    other_index_folder = tmp_path.joinpath('other')
+    index_folder.mkdir()
+    other_index_folder.mkdir()
+    dataset_index.add_files(index_folder, [('a/one.mzML', get_spectra(['scan=1'])), ('a/two.mzML', get_spectra(['scan=1']))])
+    dataset_index.add_files(other_index_folder, [('a/one.mzML', get_spectra(['scan=5', 'scan=6']))])
+    dataset_index.merge_index(index_folder, other_index_folder)
+    index = dataset_index.DatasetIndex(index_folder)
+    assert [spectrum.nativeid for spectrum in index.iter_file('a/one.mzML')] == ['scan=5', 'scan=6']
+    assert 'a/two.mzML' in index
+
+def test_add_scans_folder(tmp_path):
+    scans_folder = tmp_path.joinpath('scans')
+    scans_folder.joinpath('sub').mkdir(parents=True)
+    scans_folder.joinpath('sub', 'one.mzML.scans').write_text('scan=1\t1\t-1\nscan=2\t2\t0\n')
+    index_folder = tmp_path.joinpath('index')
+    index_folder.mkdir()
+    dataset_index.add_scans_folder(index_folder, scans_folder)
+    index = dataset_index.DatasetIndex(index_folder)
+    assert index.get('sub/one.mzML', 'scan=2') == IndexedSpectrum('sub/one.mzML', 'scan=2', 1, 2, 0)
+
+def test_empty_index(tmp_path):
+    index = dataset_index.DatasetIndex(tmp_path)
+    assert index.files == []
+    assert index.get('a/one.mzML', 'scan=1') is None
@@ -0,0 +1,69 @@
+import gzip
+import struct
+
+import gzip_blocks
+
+DATA = b''.join(b'line %d of the spectrum file\n' % line for line in range(2000))
+
+def write_bgzf(tmp_path, block_size=1000):
+    input_spectrum = tmp_path.joinpath('input.mgf.gz')
+    input_spectrum.write_bytes(gzip_blocks.compress_bgzf(DATA, block_size))
+    return input_spectrum
+
+def write_gzi(gzi_path, offsets):
+    gzi_path.write_bytes(struct.pack('<Q', len(offsets)) + b''.join(struct.pack('<QQ', offset, 0) for offset in offsets))
+
+def test_bgzf_round_trip(tmp_path):
+    input_spectrum = write_bgzf(tmp_path)
+    assert gzip.decompress(input_spectrum.read_bytes()) == DATA
+    with open(input_spectrum, 'rb') as gzip_file:
+        blocks = gzip_blocks.read_bgzf_blocks(gzip_file)
+        # Data blocks and the empty end-of-file block
+        assert len(blocks) == -(-len(DATA) // 1000) + 1
+        assert sum(block_size for _, block_size in blocks) == input_spectrum.stat().st_size
+        assert b''.join(gzip_blocks.read_blocks(gzip_file, blocks[start:stop]) for start, stop in gzip_blocks.split_blocks(blocks, 4)) == DATA
+
+def test_plain_gzip_has_no_blocks(tmp_path):
+    input_spectrum = tmp_path.joinpath('input.mgf.gz')
+    input_spectrum.write_bytes(gzip.compress(DATA))
+    assert gzip_blocks.get_gzip_blocks(input_spectrum) is None
+
+def test_gzi_blocks(tmp_path):
+    input_spectrum = write_bgzf(tmp_path)
+    with open(input_spectrum, 'rb') as gzip_file:
+        bgzf_blocks = gzip_blocks.read_bgzf_blocks(gzip_file)
+    gzi_path = tmp_path.joinpath('input.mgf.gz.gzi')
+    write_gzi(gzi_path, [offset for offset, _ in bgzf_blocks[1:]])
+    file_size = input_spectrum.stat().st_size
+    assert gzip_blocks.read_gzi_blocks(gzi_path, file_size) == bgzf_blocks
+    # A .gzi with fewer entries is used as is, its blocks span several BGZF blocks
+    write_gzi(gzi_path, [bgzf_blocks[10][0]])
+    assert gzip_blocks.get_gzip_blocks(input_spectrum) == [(0, bgzf_blocks[10][0]), (bgzf_blocks[10][0], file_size - bgzf_blocks[10][0])]
+
+def test_invalid_gzi(tmp_path):
+    input_spectrum = write_bgzf(tmp_path)
+    with open(input_spectrum, 'rb') as gzip_file:
+        bgzf_blocks = gzip_blocks.read_bgzf_blocks(gzip_file)
+    file_size = input_spectrum.stat().st_size
+    gzi_path = tmp_path.joinpath('input.mgf.gz.gzi')
+    for offsets in ([bgzf_blocks[2][0], bgzf_blocks[1][0]], [bgzf_blocks[1][0], bgzf_blocks[1][0]], [file_size + 1]):
+        write_gzi(gzi_path, offsets)
+        assert gzip_blocks.read_gzi_blocks(gzi_path, file_size) is None
+        # The block headers are read instead
+        assert gzip_blocks.get_gzip_blocks(input_spectrum) == bgzf_blocks
+    gzi_path.write_bytes(struct.pack('<QQ', 2, 0))
+    assert gzip_blocks.read_gzi_blocks(gzi_path, file_size) is None
+    gzi_path.write_bytes(b'')
+    assert gzip_blocks.read_gzi_blocks(gzi_path, file_size) is None
+
+def test_split_blocks():
+    blocks = [(offset * 100, 100) for offset in range(10)]
+    assert gzip_blocks.split_blocks(blocks) == [(0, 10)]
+    assert gzip_blocks.split_blocks(blocks, chunk_size=300) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+    assert gzip_blocks.split_blocks(blocks, min_chunks=5) == [(0, 2), (2, 4), (4, 6), (6, 8), (8, 10)]
+    # More chunks than blocks gives one block per chunk
+    assert gzip_blocks.split_blocks(blocks[:3], min_chunks=8) == [(0, 1), (1, 2), (2, 3)]
+    uneven = [(0, 500), (500, 10), (510, 10), (520, 500), (1020, 10)]
+    chunks = gzip_blocks.split_blocks(uneven, min_chunks=2)
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(uneven)
+    assert all(previous[1] == following[0] for previous, following in zip(chunks, chunks[1:]))
@@ -0,0 +1,62 @@
+import gzip
+
+import pytest
+
+import mgf_reader
+import synthetic_spectra
+
+def read_mgf(tmp_path, content, input_filetype='.mgf'):
+    input_spectrum = tmp_path.joinpath('input' + input_filetype)
+    if input_filetype == '.mgf.gz':
+        input_spectrum.write_bytes(gzip.compress(content))
+    else:
+        input_spectrum.write_bytes(content)
+    return list(mgf_reader.read_mgf_spectra(input_spectrum, input_filetype))
+
+def test_native_ids_and_ms_levels(tmp_path):
+    content = (
+        b'BEGIN IONS\nTITLE=a=b\nSCANS=5\nMSLEVEL=1\n100.0 10.0\nEND IONS\n'
+        b'BEGIN IONS\nscans=6,7\n100.0 10.0\nEND IONS\n'
+        b'BEGIN IONS\nPEPMASS=500.0\nMSLEVEL=x\nEND IONS\n'
+    )
+    assert read_mgf(tmp_path, content) == [('scan=5', 1), ('scan=6,scan=7', 2), ('index=2', 2)]
+
+def test_header_parameters_apply_to_every_block(tmp_path):
+    content = b'MSLEVEL=3\nSCANS=a=b\nBEGIN IONS\nEND IONS\nBEGIN IONS\nMSLEVEL=2\nEND IONS\nSCANS=9\n'
+    # Header values containing '=' are skipped, parameters between blocks are ignored
+    assert read_mgf(tmp_path, content) == [('index=0', 3), ('index=1', 2)]
+
+def test_block_recovery(tmp_path):
+    # Missing END IONS ends the block at the next BEGIN IONS, a block cut off at the end of the file still counts
+    content = b'BEGIN IONS\nSCANS=1\nBEGIN IONS\nSCANS=2\nEND IONS\nEND IONS\nBEGIN IONS\nSCANS=3\n100.0 10.0\n'
+    assert read_mgf(tmp_path, content) == [('scan=1', 2), ('scan=2', 2), ('scan=3', 2)]
+
+def test_crlf_and_empty_files(tmp_path):
+    content = b'BEGIN IONS\r\nSCANS=1\r\nEND IONS\r\n  BEGIN IONS \r\nMSLEVEL=1\r\nEND IONS\r\n'
+    assert read_mgf(tmp_path, content) == [('scan=1', 2), ('index=1', 1)]
+    assert read_mgf(tmp_path, b'') == []
+    assert read_mgf(tmp_path, b'', '.mgf.gz') == []
+
+def test_gzip_chunk_boundaries(tmp_path, monkeypatch):
+    content = b''.join(b'BEGIN IONS\nSCANS=%d\nMSLEVEL=%d\n100.0 10.0\nEND IONS\n' % (scan, scan % 2 + 1) for scan in range(50))
+    expected = read_mgf(tmp_path, content)
+    # Chunks shorter than a line and chunks that end without a newline
+    for chunk_size in (3, 7, 64):
+        monkeypatch.setattr(mgf_reader, 'MGF_CHUNK_SIZE', chunk_size)
+        assert read_mgf(tmp_path, content, '.mgf.gz') == expected
+        assert read_mgf(tmp_path, content.rstrip(b'\n'), '.mgf.gz') == expected
+
+@pytest.mark.parametrize('synthetic_type', ['mgf', 'mgf.gz'])
+def test_matches_pyteomics_on_synthetic_files(tmp_path, synthetic_type):
+    pyteomics_readers = pytest.importorskip('pyteomics_readers')
+    input_spectrum, = synthetic_spectra.write_synthetic_spectra(tmp_path, [synthetic_type], spectra=50, peaks=2)
+    input_filetype = '.' + synthetic_type
+    assert list(mgf_reader.read_mgf_spectra(input_spectrum, input_filetype)) == pyteomics_readers.read_mgf_pyteomics(input_spectrum, input_filetype)
+
+def test_truncated_block_differs_from_pyteomics(tmp_path):
+    pyteomics_readers = pytest.importorskip('pyteomics_readers')
+    input_spectrum = tmp_path.joinpath('input.mgf')
+    input_spectrum.write_bytes(b'BEGIN IONS\nSCANS=1\nEND IONS\nBEGIN IONS\nSCANS=2\nEND IONS\nBEGIN IONS\nSCANS=3\n100.0')
+    # pyteomics fails on the cut off block and falls back to counting blocks, the scanner keeps the SCANS of every block
+    assert pyteomics_readers.read_mgf_pyteomics(input_spectrum, '.mgf') == [('index=0', 2), ('index=1', 2), ('index=2', 2)]
+    assert list(mgf_reader.read_mgf_spectra(input_spectrum, '.mgf')) == [('scan=1', 2), ('scan=2', 2), ('scan=3', 2)]
@@ -0,0 +1,50 @@
+import os
+
+import run_manifest
+import scans_cache
+
+def make_entry(tmp_path, content=b'BEGIN IONS\nSCANS=1\nEND IONS\n'):
+    input_spectrum = tmp_path.joinpath('input.mgf')
+    input_spectrum.write_bytes(content)
+    output = tmp_path.joinpath('input.mgf.scans')
+    output.write_text('scan=1\t2\t0\n')
+    entry = run_manifest.get_manifest_entry(input_spectrum, output, scans_cache.get_content_digest(input_spectrum), '1', '0')
+    return input_spectrum, output, entry
+
+def test_unchanged_file(tmp_path):
+    input_spectrum, output, entry = make_entry(tmp_path)
+    assert run_manifest.is_unchanged(entry, input_spectrum, output, '1', '0')
+
+def test_parameters_and_output_are_checked(tmp_path):
+    input_spectrum, output, entry = make_entry(tmp_path)
+    assert not run_manifest.is_unchanged(None, input_spectrum, output, '1', '0')
+    assert not run_manifest.is_unchanged(entry, input_spectrum, output, '2', '0')
+    assert not run_manifest.is_unchanged(entry, input_spectrum, output, '1', '2')
+    assert not run_manifest.is_unchanged(entry, input_spectrum, tmp_path.joinpath('other.scans'), '1', '0')
+    output.unlink()
+    assert not run_manifest.is_unchanged(entry, input_spectrum, output, '1', '0')
+
+def test_missing_or_resized_input(tmp_path):
+    input_spectrum, output, entry = make_entry(tmp_path)
+    input_spectrum.write_bytes(b'BEGIN IONS\nSCANS=12\nEND IONS\n')
+    assert not run_manifest.is_unchanged(entry, input_spectrum, output, '1', '0')
+    input_spectrum.unlink()
+    assert not run_manifest.is_unchanged(entry, input_spectrum, output, '1', '0')
+
+def test_touched_input_is_decided_by_digest(tmp_path):
+    input_spectrum, output, entry = make_entry(tmp_path)
+    stat = os.stat(input_spectrum)
+    os.utime(input_spectrum, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run_manifest.is_unchanged(entry, input_spectrum, output, '1', '0')
+    # Same size, different content
+    input_spectrum.write_bytes(b'BEGIN IONS\nSCANS=2\nEND IONS\n')
+    os.utime(input_spectrum, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    assert not run_manifest.is_unchanged(entry, input_spectrum, output, '1', '0')
+
+def test_manifest_round_trip(tmp_path):
+    _, _, entry = make_entry(tmp_path)
+    manifest_path = run_manifest.get_manifest_path(tmp_path.joinpath('output'))
+    assert manifest_path == tmp_path.joinpath('output.manifest.tsv')
+    assert run_manifest.read_manifest(manifest_path) == {}
+    run_manifest.write_manifest(manifest_path, {entry['path']: entry})
+    assert run_manifest.read_manifest(manifest_path) == {entry['path']: entry}
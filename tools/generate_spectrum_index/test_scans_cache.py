@@ -0,0 +1,81 @@
+import os
+import time
+
+import scans_cache
+
+CACHE_PARAMS = ('1', '.mgf', '0')
+
+def write_input(tmp_path, name, content):
+    input_spectrum = tmp_path.joinpath(name)
+    input_spectrum.write_bytes(content)
+    output = tmp_path.joinpath(name + '.scans')
+    output.write_bytes(content.upper())
+    return input_spectrum, output
+
+def list_files(folder):
+    return sorted(path.relative_to(folder).as_posix() for path in folder.rglob('*') if path.is_file())
+
+def test_store_and_fetch(tmp_path):
+    cache_folder = tmp_path.joinpath('cache')
+    input_spectrum, output = write_input(tmp_path, 'a.mgf', b'first')
+    fetched = tmp_path.joinpath('fetched.scans')
+    assert not scans_cache.fetch_cached_scans(cache_folder, input_spectrum, fetched, CACHE_PARAMS)
+    scans_cache.store_cached_scans(cache_folder, input_spectrum, output, CACHE_PARAMS)
+    assert scans_cache.fetch_cached_scans(cache_folder, input_spectrum, fetched, CACHE_PARAMS)
+    assert fetched.read_bytes() == b'FIRST'
+    # Fetching over an output that is already the cached file leaves no temporary file behind
+    assert scans_cache.fetch_cached_scans(cache_folder, input_spectrum, fetched, CACHE_PARAMS)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['a.mgf', 'a.mgf.scans', 'cache', 'fetched.scans']
+
+def test_parameters_and_content_are_part_of_the_key(tmp_path):
+    cache_folder = tmp_path.joinpath('cache')
+    input_spectrum, output = write_input(tmp_path, 'a.mgf', b'first')
+    scans_cache.store_cached_scans(cache_folder, input_spectrum, output, CACHE_PARAMS)
+    fetched = tmp_path.joinpath('fetched.scans')
+    assert not scans_cache.fetch_cached_scans(cache_folder, input_spectrum, fetched, ('1', '.mgf', '2'))
+    input_spectrum.write_bytes(b'second, longer')
+    assert not scans_cache.fetch_cached_scans(cache_folder, input_spectrum, fetched, CACHE_PARAMS)
+    # A copy with the same content under another path shares the entry
+    copy, _ = write_input(tmp_path, 'b.mgf', b'first')
+    assert scans_cache.fetch_cached_scans(cache_folder, copy, fetched, CACHE_PARAMS)
+
+def test_digest_is_remembered_by_path_size_and_mtime(tmp_path):
+    cache_folder = tmp_path.joinpath('cache')
+    input_spectrum, _ = write_input(tmp_path, 'a.mgf', b'first')
+    digest = scans_cache.get_content_digest(input_spectrum, cache_folder)
+    assert digest == scans_cache.get_content_digest(input_spectrum)
+    assert list_files(cache_folder.joinpath(scans_cache.STAT_FOLDER))
+    assert scans_cache.get_content_digest(input_spectrum, cache_folder) == digest
+
+def test_evict_least_recently_used(tmp_path):
+    cache_folder = tmp_path.joinpath('cache')
+    now = time.time()
+    cached_paths = []
+    for age, name in enumerate(['a.mgf', 'b.mgf', 'c.mgf']):
+        input_spectrum, output = write_input(tmp_path, name, name.encode() * 100)
+        scans_cache.store_cached_scans(cache_folder, input_spectrum, output, CACHE_PARAMS)
+        cached_path = scans_cache.get_cached_path(cache_folder, scans_cache.get_content_digest(input_spectrum), CACHE_PARAMS)
+        os.utime(cached_path, (now - 1000 + age, now - 1000 + age))
+        cached_paths.append(cached_path)
+    # Fetching a.mgf makes it the most recently used entry
+    assert scans_cache.fetch_cached_scans(cache_folder, tmp_path.joinpath('a.mgf'), tmp_path.joinpath('fetched.scans'), CACHE_PARAMS)
+    entry_size = cached_paths[0].stat().st_size
+    scans_cache.evict_cached_scans(cache_folder, 2 * entry_size)
+    assert [cached_path.exists() for cached_path in cached_paths] == [True, False, True]
+    scans_cache.evict_cached_scans(cache_folder, 0)
+    assert not list_files(cache_folder.joinpath(scans_cache.OBJECTS_FOLDER))
+
+def test_evict_prunes_stale_digests(tmp_path):
+    cache_folder = tmp_path.joinpath('cache')
+    input_spectrum, output = write_input(tmp_path, 'a.mgf', b'first')
+    scans_cache.store_cached_scans(cache_folder, input_spectrum, output, CACHE_PARAMS)
+    stale_spectrum, _ = write_input(tmp_path, 'gone.mgf', b'gone')
+    scans_cache.get_content_digest(stale_spectrum, cache_folder)
+    stat_folder = cache_folder.joinpath(scans_cache.STAT_FOLDER)
+    assert len(list_files(stat_folder)) == 2
+    stale_stat = next(path for path in stat_folder.rglob('*') if path.is_file() and path.read_text() == scans_cache.get_content_digest(stale_spectrum))
+    old = time.time() - scans_cache.STAT_GRACE_SECONDS - 1000
+    os.utime(stale_stat, (old, old))
+    scans_cache.evict_cached_scans(cache_folder, 10**9)
+    assert not stale_stat.exists()
+    assert len(list_files(stat_folder)) == 1
@@ -0,0 +1,316 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from xml.sax.saxutils import unescape
+import gzip
+import re
+import zlib
+
+from lxml import etree
+
+import file_utils
+import gzip_blocks
+
+MS_LEVEL_ACCESSION = 'MS:1000511'
+
+# Block sizes for the seek-based reads of the indexed engine
+INDEX_TAIL_SIZE = 4096
+INDEX_BLOCK_SIZE = 1024 * 1024
+HEADER_BLOCK_SIZE = 4096
+
+XML_ATTRIBUTE_ENTITIES = {'&quot;': '"', '&apos;': "'"}
+
+MZML_INDEX_OFFSET_PATTERN = re.compile(rb'<indexListOffset>\s*(\d+)\s*</indexListOffset>')
+MZML_INDEX_PATTERN = re.compile(rb'<index\s+name="spectrum"\s*>')
+MZML_OFFSET_PATTERN = re.compile(rb'<offset\s[^>]*?\bidRef="([^"]*)"[^>]*>\s*(\d+)\s*</offset>')
+MZML_LIST_PATTERN = re.compile(rb'<spectrumList\b[^>]*>')
+MZML_PARAM_GROUP_LIST_PATTERN = re.compile(rb'<referenceableParamGroupList\b.*?</referenceableParamGroupList>', re.S)
+MZML_SPECTRUM_PATTERN = re.compile(rb'<spectrum\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+# Spectrum-level params come before the scan, precursor, product and binary lists
+MZML_SPECTRUM_START_PATTERN = re.compile(rb'<spectrum[\s/>]')
+MZML_SPECTRUM_HEADER_END_PATTERN = re.compile(rb'<(?:scanList|precursorList|productList|binaryDataArrayList)[\s/>]|</spectrum>')
+
+MZXML_INDEX_OFFSET_PATTERN = re.compile(rb'<indexOffset>\s*(\d+)\s*</indexOffset>')
+MZXML_INDEX_PATTERN = re.compile(rb'<index\s+name="scan"\s*>')
+MZXML_OFFSET_PATTERN = re.compile(rb'<offset\s[^>]*?\bid="([^"]*)"[^>]*>\s*(\d+)\s*</offset>')
+MZXML_LIST_PATTERN = re.compile(rb'<msRun\b[^>]*>')
+MZXML_SCAN_PATTERN = re.compile(rb'<scan\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+LIST_COUNT_PATTERN = re.compile(rb'\b(?:count|scanCount)="(\d+)"')
+
+# Bytes past a blocked gzip chunk scanned for split start tags, and blocks past it a worker may need for the last header
+GZIP_CHUNK_LOOKAHEAD = 64
+GZIP_OVERFLOW_BLOCKS = 16
+# Chunks per block worker submitted ahead of the one being read, so memory is bounded by the chunk size, not the file
+GZIP_CHUNKS_AHEAD = 2
+
+def _get_ms_level(element):
+    # Only cvParams directly under the element, nested scan/precursor params are not the spectrum's
+    for cv_param in element.iterchildren('{*}cvParam'):
+        if cv_param.get('accession') == MS_LEVEL_ACCESSION:
+            return cv_param.get('value')
+    return None
+
+def _get_spectrum_ms_level(s, param_groups, default_ms_level):
+    ms_level = _get_ms_level(s)
+    if not ms_level:
+        spec_param_group = s.find('{*}referenceableParamGroupRef')
+        if spec_param_group is not None:
+            ms_level = param_groups[spec_param_group.get('ref')]
+        else:
+            ms_level = default_ms_level
+    return int(ms_level)
+
+def read_mzxml_stream(input_spectrum):
+    with open(input_spectrum, 'rb') as mzxml_file:
+        # Scan attributes are complete at the start tag, so peaks are never decoded. Offsets of the trailing index
+        # are matched only so they get cleared as well
+        for event, s in etree.iterparse(mzxml_file, events=('start', 'end'), tag=('{*}scan', '{*}offset'), huge_tree=True):
+            if event == 'end':
+                file_utils.clear_element(s)
+            elif etree.QName(s).localname == 'scan':
+                # Always use scan= for nativeID for mzXML
+                yield 'scan={}'.format(s.get('num')), int(s.get('msLevel'))
+
+def read_mzml_stream(input_spectrum, open_spectrum, default_ms_level):
+    # referenceableParamGroupList always precedes <run>, so groups are known before any spectrum refers to them
+    param_groups = {}
+    with open_spectrum(input_spectrum, 'rb') as mzml_file:
+        # Chromatograms and the offsets of the indexedmzML index are matched only so they get cleared as well
+        for _, s in etree.iterparse(mzml_file, tag=('{*}referenceableParamGroup', '{*}spectrum', '{*}chromatogram', '{*}offset'), huge_tree=True):
+            element_name = etree.QName(s).localname
+            if element_name == 'spectrum':
+                ms_level = _get_spectrum_ms_level(s, param_groups, default_ms_level)
+                # Always use given nativeID for mzML
+                native_id = s.get('id')
+                file_utils.clear_element(s)
+                yield native_id, ms_level
+            else:
+                if element_name == 'referenceableParamGroup':
+                    param_groups[s.get('id')] = _get_ms_level(s)
+                file_utils.clear_element(s)
+
+def _iter_offset_index(index_file, index_offset, index_pattern, offset_pattern):
+    # (id, offset) of each entry of the index, read in blocks so memory does not grow with the spectrum count
+    index_file.seek(index_offset)
+    data = b''
+    in_index = False
+    while True:
+        block = index_file.read(INDEX_BLOCK_SIZE)
+        data += block
+        if not in_index:
+            index_match = index_pattern.search(data)
+            if not index_match:
+                if not block:
+                    return
+                continue
+            data = data[index_match.end():]
+            in_index = True
+        index_end = data.find(b'</index>')
+        position = 0
+        # Offsets only match once their closing tag is read, so one cut off by the block is matched with the next block
+        for offset_match in offset_pattern.finditer(data, 0, len(data) if index_end < 0 else index_end):
+            yield unescape(offset_match.group(1).decode(), XML_ATTRIBUTE_ENTITIES), int(offset_match.group(2))
+            position = offset_match.end()
+        if index_end >= 0 or not block:
+            return
+        data = data[position:]
+
+def _read_offset_index(spectrum_file, index_offset_pattern, index_pattern, offset_pattern):
+    # Offset and entry count of the index, the entries are only checked here and read again by _iter_offset_index
+    file_size = spectrum_file.seek(0, 2)
+    spectrum_file.seek(max(0, file_size - INDEX_TAIL_SIZE))
+    index_offset_match = index_offset_pattern.search(spectrum_file.read())
+    if not index_offset_match:
+        return None
+    index_offset = int(index_offset_match.group(1))
+    if index_offset >= file_size:
+        return None
+    # Offsets have to be increasing and point before the index itself, otherwise the index is stale
+    index_count = 0
+    previous_offset = -1
+    for _, offset in _iter_offset_index(spectrum_file, index_offset, index_pattern, offset_pattern):
+        if offset <= previous_offset or offset >= index_offset:
+            return None
+        previous_offset = offset
+        index_count += 1
+    if not index_count:
+        return None
+    return index_offset, index_count
+
+def _read_document_header(spectrum_file, list_pattern):
+    # Everything up to and including the start tag of the spectrum list
+    spectrum_file.seek(0)
+    header = b''
+    while True:
+        block = spectrum_file.read(HEADER_BLOCK_SIZE)
+        if not block:
+            return None, None
+        header += block
+        list_match = list_pattern.search(header)
+        if list_match:
+            return header[:list_match.start()], list_match.group()
+
+def _index_matches_list_count(index_count, list_tag):
+    list_count = LIST_COUNT_PATTERN.search(list_tag)
+    return list_count is None or int(list_count.group(1)) == index_count
+
+def _find_element_header(block, position, element_name, start_tag_pattern, header_end_pattern=None):
+    # The element header closed off so it parses on its own, None if block ends before the header does
+    start_tag = start_tag_pattern.match(block, position)
+    if not start_tag:
+        return None
+    if start_tag.group().endswith(b'/>'):
+        return start_tag.group()
+    close_tag = b'</' + element_name + b'>'
+    if header_end_pattern is None:
+        return start_tag.group() + close_tag
+    header_end = header_end_pattern.search(block, start_tag.end())
+    if header_end:
+        return block[position:header_end.start()] + close_tag
+    return None
+
+def _read_element_header(spectrum_file, offset, element_name, start_tag_pattern, header_end_pattern=None):
+    spectrum_file.seek(offset)
+    block = spectrum_file.read(HEADER_BLOCK_SIZE)
+    # A stale offset does not land on the start tag of the element
+    if not re.match(rb'<' + element_name + rb'[\s/>]', block):
+        return None
+    while True:
+        element_header = _find_element_header(block, 0, element_name, start_tag_pattern, header_end_pattern)
+        if element_header:
+            break
+        more = spectrum_file.read(len(block))
+        if not more:
+            return None
+        block += more
+    try:
+        return etree.fromstring(element_header)
+    except etree.XMLSyntaxError:
+        return None
+
+def _read_param_groups(header):
+    param_groups = {}
+    param_group_list = MZML_PARAM_GROUP_LIST_PATTERN.search(header)
+    if param_group_list:
+        for ref in etree.fromstring(param_group_list.group()).iterchildren('{*}referenceableParamGroup'):
+            param_groups[ref.get('id')] = _get_ms_level(ref)
+    return param_groups
+
+def read_mzxml_indexed(input_spectrum):
+    indexed_scans = 0
+    with open(input_spectrum, 'rb') as mzxml_file:
+        index = _read_offset_index(mzxml_file, MZXML_INDEX_OFFSET_PATTERN, MZXML_INDEX_PATTERN, MZXML_OFFSET_PATTERN)
+        if index is not None:
+            index_offset, index_count = index
+            _, list_tag = _read_document_header(mzxml_file, MZXML_LIST_PATTERN)
+            if list_tag is not None and _index_matches_list_count(index_count, list_tag):
+                # The index is read through its own handle while mzxml_file seeks to each scan
+                with open(input_spectrum, 'rb') as index_file:
+                    for scan_num, offset in _iter_offset_index(index_file, index_offset, MZXML_INDEX_PATTERN, MZXML_OFFSET_PATTERN):
+                        s = _read_element_header(mzxml_file, offset, b'scan', MZXML_SCAN_PATTERN)
+                        if s is None or s.get('num') != scan_num:
+                            break
+                        # Always use scan= for nativeID for mzXML
+                        yield 'scan={}'.format(scan_num), int(s.get('msLevel'))
+                        indexed_scans += 1
+                    else:
+                        return
+    # The index is missing or stale, continue with the stream parser after the scans already read
+    yield from islice(read_mzxml_stream(input_spectrum), indexed_scans, None)
+
+def read_mzml_indexed(input_spectrum, default_ms_level):
+    indexed_spectra = 0
+    with open(input_spectrum, 'rb') as mzml_file:
+        index = _read_offset_index(mzml_file, MZML_INDEX_OFFSET_PATTERN, MZML_INDEX_PATTERN, MZML_OFFSET_PATTERN)
+        if index is not None:
+            index_offset, index_count = index
+            header, list_tag = _read_document_header(mzml_file, MZML_LIST_PATTERN)
+            if list_tag is not None and _index_matches_list_count(index_count, list_tag):
+                param_groups = _read_param_groups(header)
+                # The index is read through its own handle while mzml_file seeks to each spectrum
+                with open(input_spectrum, 'rb') as index_file:
+                    for spectrum_id, offset in _iter_offset_index(index_file, index_offset, MZML_INDEX_PATTERN, MZML_OFFSET_PATTERN):
+                        s = _read_element_header(mzml_file, offset, b'spectrum', MZML_SPECTRUM_PATTERN, MZML_SPECTRUM_HEADER_END_PATTERN)
+                        if s is None or s.get('id') != spectrum_id:
+                            break
+                        # Always use given nativeID for mzML
+                        yield spectrum_id, _get_spectrum_ms_level(s, param_groups, default_ms_level)
+                        indexed_spectra += 1
+                    else:
+                        return
+    # The index is missing or stale, continue with the stream parser after the spectra already read
+    yield from islice(read_mzml_stream(input_spectrum, open, default_ms_level), indexed_spectra, None)
+
+def _scan_mzml_gzip_chunk(input_spectrum, blocks, chunk_block_count, param_groups, default_ms_level):
+    # Spectra whose start tag begins in the first chunk_block_count blocks, later blocks only complete their headers
+    spectra = []
+    with open(input_spectrum, 'rb') as gzip_file:
+        data = gzip_blocks.read_blocks(gzip_file, blocks[:chunk_block_count])
+        chunk_length = len(data)
+        next_block = chunk_block_count
+        position = 0
+        while True:
+            # Look a little past the chunk, a start tag may be split across the boundary
+            while len(data) < chunk_length + GZIP_CHUNK_LOOKAHEAD and next_block < len(blocks):
+                data += gzip_blocks.read_blocks(gzip_file, blocks[next_block:next_block + 1])
+                next_block += 1
+            spectrum_start = MZML_SPECTRUM_START_PATTERN.search(data, position)
+            if spectrum_start is None or spectrum_start.start() >= chunk_length:
+                return spectra
+            element_header = _find_element_header(data, spectrum_start.start(), b'spectrum', MZML_SPECTRUM_PATTERN, MZML_SPECTRUM_HEADER_END_PATTERN)
+            if element_header is None:
+                if next_block == len(blocks):
+                    raise ValueError('Spectrum header at the end of chunk is incomplete')
+                data += gzip_blocks.read_blocks(gzip_file, blocks[next_block:next_block + 1])
+                next_block += 1
+                continue
+            s = etree.fromstring(element_header)
+            # Always use given nativeID for mzML
+            spectra.append((s.get('id'), _get_spectrum_ms_level(s, param_groups, default_ms_level)))
+            position = spectrum_start.end()
+
+def read_mzml_gzip_blocks(input_spectrum, default_ms_level, block_workers):
+    yielded_spectra = 0
+    blocks = gzip_blocks.get_gzip_blocks(input_spectrum)
+    if blocks and len(blocks) > 1:
+        with gzip.open(input_spectrum, 'rb') as mzml_file:
+            header, list_tag = _read_document_header(mzml_file, MZML_LIST_PATTERN)
+        if list_tag is not None:
+            param_groups = _read_param_groups(header)
+            chunks = deque(gzip_blocks.split_blocks(blocks, block_workers * 4))
+            try:
+                with ProcessPoolExecutor(max_workers=block_workers) as executor:
+                    futures = deque()
+                    while chunks or futures:
+                        while chunks and len(futures) < block_workers * GZIP_CHUNKS_AHEAD:
+                            start, stop = chunks.popleft()
+                            futures.append(executor.submit(_scan_mzml_gzip_chunk, input_spectrum, blocks[start:stop + GZIP_OVERFLOW_BLOCKS], stop - start, param_groups, default_ms_level))
+                        # Chunks are stitched back in file order so the MS2+ index stays contiguous
+                        for spectrum in futures.popleft().result():
+                            yield spectrum
+                            yielded_spectra += 1
+                list_count = LIST_COUNT_PATTERN.search(list_tag)
+                if list_count is None or int(list_count.group(1)) == yielded_spectra:
+                    return
+            except (OSError, EOFError, ValueError, zlib.error, etree.XMLSyntaxError):
+                pass
+    # Not a blocked gzip, or the blocks did not scan cleanly, so continue with the stream parser after the spectra already read
+    yield from islice(read_mzml_stream(input_spectrum, gzip.open, default_ms_level), yielded_spectra, None)
+
+def read_stream(input_spectrum, input_filetype, default_ms_level, block_workers=1):
+    if input_filetype == '.mzxml':
+        return read_mzxml_stream(input_spectrum)
+    if input_filetype == '.mzml.gz':
+        if block_workers > 1:
+            return read_mzml_gzip_blocks(input_spectrum, default_ms_level, block_workers)
+        return read_mzml_stream(input_spectrum, gzip.open, default_ms_level)
+    return read_mzml_stream(input_spectrum, open, default_ms_level)
+
+def read_indexed(input_spectrum, input_filetype, default_ms_level, block_workers=1):
+    if input_filetype == '.mzxml':
+        return read_mzxml_indexed(input_spectrum)
+    if input_filetype == '.mzml':
+        return read_mzml_indexed(input_spectrum, default_ms_level)
+    # Offsets in the index are into the uncompressed file, so gzip input is always streamed
+    return read_stream(input_spectrum, input_filetype, default_ms_level, block_workers)